@@ -0,0 +1,146 @@
+"""Idle overhead: how many idle sessions fit on one host.
+
+Launches N headless drivers wrapping an idle shell, connects one pilot to
+each (in this process), then samples /proc over a window and reports total
+CPU%, RSS and wakeups per second (context switches) as N grows.
+
+Linux only (reads /proc).
+
+Usage: python3 -m bench.density [--counts 1,10,50] [--seconds 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import ptyrc.common as common
+import ptyrc.driver
+from ptyrc.pilot import pilot_backend, pilot_frontend
+
+ticks = os.sysconf("SC_CLK_TCK")
+
+
+def children_of(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def sample(pid):
+    """(cpu seconds, rss kB, context switches) of pid, all threads included"""
+
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        rss = int(status.get("VmRSS", "0 kB").split()[0])
+
+        switches = 0
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/status") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in ("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches"):
+                        switches += int(value)
+    except (OSError, ValueError):
+        return 0, 0, 0
+    return cpu, rss, switches
+
+
+def measure(pids, seconds):
+    before = [sample(pid) for pid in pids]
+    time.sleep(seconds)
+    after = [sample(pid) for pid in pids]
+
+    cpu = sum(a[0] - b[0] for a, b in zip(after, before))
+    switches = sum(a[2] - b[2] for a, b in zip(after, before))
+    return dict(
+        cpu_percent=100 * cpu / seconds,
+        rss_kb=sum(a[1] for a in after),
+        wakeups_per_second=switches / seconds,
+    )
+
+
+def run(count, *, port, seconds, shell="sh"):
+    drivers = []
+    backends = []
+    try:
+        for i in range(count):
+            drivers.append(ptyrc.driver.spawn_headless([shell], start_port=port + i))
+
+        pilots = []
+        for i in range(count):
+            backend = pilot_backend(start_port=port + i, port_range=1, timeout=10)
+            backend.setup_jobs()
+            for job in backend.jobs:
+                job.start()
+            backends.append(backend)
+            pilots.append(pilot_frontend(backend=backend, timeout=10))
+
+        for pilot in pilots:
+            pilot.wait_for_driver(animated=False)
+        time.sleep(2)  # (settle: initial latency, first refresh)
+
+        driver_pids = [driver.pid for driver in drivers]
+        child_pids = [pid for dpid in driver_pids for pid in children_of(dpid)]
+
+        result = dict(sessions=count)
+        for name, pids in [
+            ("drivers", driver_pids),
+            ("children", child_pids),
+            ("pilots", [os.getpid()]),
+        ]:
+            result[name] = measure(pids, seconds)
+        return result
+
+    finally:
+        for backend in backends:
+            backend.finished = True
+        for driver in drivers:
+            driver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--counts", default="1,10,50")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=common.start_port + 2000)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'sessions':>8} {'component':>9} {'cpu %':>7} {'rss MB':>8} {'wakeups/s':>10}"
+    )
+    for count in [int(c) for c in args.counts.split(",")]:
+        result = run(count, port=args.port, seconds=args.seconds)
+        results.append(result)
+
+        for name in ["drivers", "children", "pilots"]:
+            r = result[name]
+            print(
+                f"{count:>8} {name:>9} {r['cpu_percent']:7.2f} "
+                f"{r['rss_kb'] / 1024:8.1f} {r['wakeups_per_second']:10.0f}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""End-to-end benchmark: workload -> ptyrc-driver -> pilot.
+
+Each workload of bench.workloads runs under a headless driver, with a pilot
+connected to it. Measures child output throughput, update latency (traced),
+bytes on the wire and CPU time of the child, the driver and the pilot.
+
+Usage: python3 -m bench.pipeline [--output results.json]
+                                 [--baseline baseline.json] [--tolerance 0.1]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import ptyrc.common as common
+import ptyrc.driver
+from ptyrc.pilot import pilot_backend, pilot_frontend
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (default amount: megabytes for bulk, seconds otherwise)
+default_workloads = dict(bulk=20, redraw=3, scroll=3, color=3, echo=200)
+
+# metric -> True if higher is better
+directions = dict(
+    throughput_mbps=True,
+    latency_p50=False,
+    latency_p99=False,
+    echo_p50=False,
+    echo_p99=False,
+    wire_bytes=False,
+    cpu_child=False,
+    cpu_driver=False,
+    cpu_pilot=False,
+)
+
+
+def _cpu(usage):
+    if not usage:
+        return None
+    return usage["cpu_user"] + usage["cpu_system"]
+
+
+def _pilot_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+def _echo(pilot, keystrokes, timeout=2):
+    """type keystrokes one by one, returns echo latencies (seconds)"""
+
+    def _count():
+        return sum(len(line.replace(" ", "")) for line in pilot.handler.display)
+
+    latencies = []
+    expected = _count()
+    for i in range(keystrokes):
+        if i > 0 and i % 40 == 0:
+            pilot.input("\r")
+
+        started = time.time()
+        pilot.input(chr(ord("a") + i % 26))
+        expected += 1
+        while _count() < expected:
+            if time.time() - started > timeout:
+                raise TimeoutError(f"keystroke {i} was not echoed")
+            time.sleep(0.0005)
+        latencies.append(time.time() - started)
+
+    pilot.input("\x04")
+    return latencies
+
+
+def run_workload(name, amount, *, port, size=(80, 24), timeout=120):
+    argv_cmd = [sys.executable, "-m", "bench.workloads", name, str(amount)]
+    pythonpath = os.pathsep.join([repo_root, os.environ.get("PYTHONPATH", "")])
+    driver = ptyrc.driver.spawn_headless(
+        argv_cmd, start_port=port, size=size, env=dict(PYTHONPATH=pythonpath)
+    )
+
+    backend = pilot_backend(start_port=port, port_range=2, timeout=10)
+    backend.setup_jobs()
+    for job in backend.jobs:
+        job.start()
+    pilot = pilot_frontend(backend=backend, timeout=10)
+
+    try:
+        pilot.wait_for_driver(animated=False)
+        time.sleep(1.5)  # (driver buffers its first second of output)
+        pilot.trace()
+
+        cpu_pilot = _pilot_cpu()
+        started = time.time()
+
+        result = dict()
+        if name == "echo":
+            latencies = _echo(pilot, int(amount))
+            result["echo_p50"] = _percentile(latencies, 50)
+            result["echo_p99"] = _percentile(latencies, 99)
+        else:
+            pilot.input("\r")  # (go)
+
+        # sample stats until the driver exits (last sample is kept)
+        stats = dict()
+        while driver.poll() is None:
+            if time.time() - started > timeout:
+                raise TimeoutError(f"workload {name} did not finish")
+            try:
+                stats = pilot.stats
+            except (TimeoutError, BrokenPipeError, OSError):
+                pass
+            time.sleep(0.25)
+        elapsed = time.time() - started
+
+        latency = pilot.backend.active_handler.tracer.summary()["total"]
+        result.update(
+            seconds=elapsed,
+            output_bytes=driver.output_bytes,
+            throughput_mbps=driver.output_bytes / (1024 * 1024) / elapsed,
+            latency_p50=latency["p50"],
+            latency_p99=latency["p99"],
+            wire_bytes=stats.get("bytes_sent", 0)
+            + stats.get("client", dict()).get("bytes_sent", 0),
+            frames=stats.get("frames"),
+            cpu_child=_cpu(stats.get("child")),
+            cpu_driver=_cpu(stats.get("driver")),
+            cpu_pilot=_pilot_cpu() - cpu_pilot,
+        )
+        return result
+
+    finally:
+        backend.finished = True
+        driver.close()
+
+
+def compare(results, baseline, tolerance):
+    """returns regressions (as text) of results against baseline"""
+
+    regressions = []
+    for name, metrics in results["workloads"].items():
+        reference = baseline.get("workloads", dict()).get(name)
+        if reference is None:
+            continue
+
+        for metric, higher_is_better in directions.items():
+            new, old = metrics.get(metric), reference.get(metric)
+            if not new or not old:
+                continue
+
+            ratio = new / old
+            if (higher_is_better and ratio < 1 - tolerance) or (
+                not higher_is_better and ratio > 1 + tolerance
+            ):
+                regressions.append(f"{name}.{metric}: {old:.6g} -> {new:.6g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workloads", default=",".join(default_workloads))
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--port", type=int, default=common.start_port + 1000)
+    parser.add_argument("--size", default="80x24")
+    args = parser.parse_args()
+
+    size = tuple(int(x) for x in args.size.split("x"))
+    results = dict(
+        version=".".join(str(v) for v in common.version),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        size=size,
+        time=time.time(),
+        workloads=dict(),
+    )
+
+    for i, name in enumerate(args.workloads.split(",")):
+        amount = default_workloads[name]
+        port = args.port + i * 2
+        metrics = run_workload(name, amount, port=port, size=size)
+        results["workloads"][name] = metrics
+
+        summary = ", ".join(
+            f"{k}={v:.4g}" for k, v in metrics.items() if isinstance(v, float)
+        )
+        print(f"{name:>8}: {summary}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Throughput of `cat bigfile` through a ptyrc driver (in MB/s).
+
+Usage: python3 bench/pump.py [size_in_mb] [repeat]
+"""
+
+import os
+import pty
+import select
+import sys
+import tempfile
+import time
+
+driver_cmd = [sys.executable, "-c", "from ptyrc.driver import main; main()"]
+
+
+def make_bigfile(size_mb, path):
+    line = b"".join(bytes([0x20 + (i % 95)]) for i in range(79)) + b"\n"
+    with open(path, "wb") as f:
+        for _ in range(size_mb * 1024 * 1024 // len(line)):
+            f.write(line)
+    return os.path.getsize(path)
+
+
+def run(argv, *, env=None):
+    """Run argv under a fresh pty, drain its output, returns (seconds, nbytes)"""
+
+    pid, master_fd = pty.fork()
+    if pid == pty.CHILD:
+        os.execvpe(argv[0], argv, env or os.environ)
+
+    nbytes = 0
+    started = None
+    while True:
+        r, _, _ = select.select([master_fd], [], [], 10)
+        if not r:
+            break
+        try:
+            data = os.read(master_fd, 1024 * 256)
+        except OSError:
+            break
+        if not data:
+            break
+        started = started or time.time()
+        nbytes += len(data)
+
+    os.waitpid(pid, 0)
+    os.close(master_fd)
+    return time.time() - (started or time.time()), nbytes
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bigfile")
+        size = make_bigfile(size_mb, path)
+
+        for name, argv in [
+            ("raw pty", ["cat", path]),
+            ("ptyrc-driver", driver_cmd + ["cat", path]),
+        ]:
+            best = None
+            for _ in range(repeat):
+                elapsed, _ = run(argv)
+                best = elapsed if best is None else min(best, elapsed)
+            mbps = size / (1024 * 1024) / max(best, 1e-9)
+            print(f"{name:>14}: {mbps:8.1f} MB/s ({best:.2f}s for {size_mb} MB)")
+
+
+if __name__ == "__main__":
+    main()
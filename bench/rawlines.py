@@ -0,0 +1,140 @@
+"""Cost of packing a full screen refresh into set_rawline payloads.
+
+Compares the per-cell path (charspec.pack of each cell) to pack_row (one
+dict lookup per cell) and to the numpy cell grid on a colorful screen, and
+the size & cost of the run-length encoding (rawline encoding 2) on colorful
+& sparse screens.
+
+Cell grid timings are totals: "cold" repacks every row (as for a new
+pilot), "warm" none (rows unchanged since the last call), and "dirty" the
+changed rows only, as get_packed_lines does after a flush.
+
+Usage: python3 bench/rawlines.py [nbcols] [nbrows] [repeat]
+"""
+
+import random
+import sys
+import time
+
+import ptyrc.cellgrid
+import ptyrc.screen
+import ptyrc.termcap as termcap
+
+
+def colorful_screen(nbcols, nbrows, seed=0):
+    rng = random.Random(seed)
+    terminal = ptyrc.screen.screen((nbcols, nbrows))
+
+    out = b""
+    for lineno in range(nbrows):
+        out += b"\x1b[%d;1H" % (lineno + 1)
+        for colno in range(nbcols):
+            if rng.random() < 0.2:
+                out += b"\x1b[%d;%dm" % (rng.randint(30, 37), rng.randint(40, 47))
+            out += bytes([rng.randint(0x21, 0x7E)])
+    terminal.feed(out)
+    terminal.flush(clear=True)
+    return terminal
+
+
+def sparse_screen(nbcols, nbrows, seed=0):
+    rng = random.Random(seed)
+    terminal = ptyrc.screen.screen((nbcols, nbrows))
+
+    out = b""
+    for lineno in range(nbrows):
+        out += b"\x1b[%d;1H\x1b[1;32muser@host\x1b[0m:~$ " % (lineno + 1)
+        out += bytes(rng.randint(0x21, 0x7E) for _ in range(rng.randint(0, 40)))
+    terminal.feed(out)
+    terminal.flush(clear=True)
+    return terminal
+
+
+def per_cell(terminal, linelist):
+    packed = dict()
+    for lineno, chars in terminal.get_raw_lines(linelist).items():
+        packedline = b""
+        for raw_char in chars:
+            packedline += raw_char.pack()
+        packed[lineno] = packedline
+    return packed
+
+
+def timeit(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    nbcols = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    nbrows = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    terminal = colorful_screen(nbcols, nbrows)
+    linelist = list(range(nbrows))
+
+    elapsed, reference = timeit(lambda: per_cell(terminal, linelist), repeat)
+    print(f"  per-cell pack: {elapsed * 1000:8.2f} ms/refresh ({nbcols}x{nbrows})")
+
+    for name, screen in [("colorful", terminal), ("sparse", sparse_screen)]:
+        if name != "colorful":
+            screen = screen(nbcols, nbrows)
+        lines = per_cell(screen, linelist)
+
+        def _runs():
+            return {lineno: termcap.pack_runs(p) for lineno, p in lines.items()}
+
+        elapsed, runs = timeit(_runs, repeat)
+        assert all(termcap.unpack_runs(runs[k]) == p for k, p in lines.items())
+        ratio = sum(map(len, runs.values())) / sum(map(len, lines.values()))
+        print(
+            f"  runs {name:>8}: {elapsed * 1000:8.2f} ms/refresh"
+            f" ({ratio:.1%} of encoding 1 bytes)"
+        )
+
+    snapshot = terminal.snapshot()
+    elapsed, packed = timeit(
+        lambda: {
+            lineno: ptyrc.cellgrid.pack_row(snapshot.cells[lineno])
+            for lineno in linelist
+        },
+        repeat,
+    )
+    assert packed == reference
+    print(f"      pack_row: {elapsed * 1000:8.2f} ms/refresh ({nbcols}x{nbrows})")
+
+    if not ptyrc.cellgrid.available():
+        print("     cell grid: (numpy not installed)")
+        return
+
+    def _cold():
+        terminal.cellgrid = None
+        return terminal.get_packed_lines(linelist)
+
+    elapsed, packed = timeit(_cold, repeat)
+    assert packed == reference
+    print(f"   grid (cold): {elapsed * 1000:8.2f} ms/refresh ({nbcols}x{nbrows})")
+
+    elapsed, packed = timeit(lambda: terminal.get_packed_lines(linelist), repeat)
+    assert packed == reference
+    print(f"   grid (warm): {elapsed * 1000:8.2f} ms/refresh ({nbcols}x{nbrows})")
+
+    dirty = list(range(0, nbrows, 4))
+
+    def _dirty():
+        for lineno in dirty:  # (as if changed by a flush)
+            terminal.cellgrid.rows[lineno] = None
+        return terminal.get_packed_lines(linelist)
+
+    elapsed, packed = timeit(_dirty, repeat)
+    assert packed == reference
+    print(f"  grid (dirty): {elapsed * 1000:8.2f} ms/refresh ({len(dirty)} dirty rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Startup time: imports, and time to first connection of driver and pilot.
+
+Usage: python3 bench/startup.py [repeat]
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import ptyrc.common as common
+import ptyrc.driver
+
+heavy_modules = ["pyte", "code", "subprocess", "threading", "termios", "socket"]
+
+pilot_script = """
+def main(pilot):
+    pilot.wait_for_driver(animated=False)
+    print("connected", flush=True)
+    pilot.quit()
+"""
+
+
+def import_time(module, repeat):
+    """best wall time of importing module in a fresh interpreter (seconds)"""
+
+    check = f"import sys; print([m for m in {heavy_modules!r} if m in sys.modules])"
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = subprocess.check_output(
+            [sys.executable, "-c", f"import {module}; {check}"]
+        )
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out.decode().strip()
+
+
+def driver_ready(port, timeout=10):
+    """time until a driver on port accepts a connection and says hello"""
+
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            with socket.create_connection(("localhost", port), timeout=1) as remote:
+                if remote.recv(common.global_buffer_size):
+                    return time.perf_counter() - started
+        except OSError:
+            time.sleep(0.005)
+    raise TimeoutError(f"no driver on port {port}")
+
+
+def driver_startup(port):
+    started = time.perf_counter()
+    driver = ptyrc.driver.spawn_headless(["sh"], start_port=port)
+    try:
+        driver_ready(port)
+        return time.perf_counter() - started
+    finally:
+        driver.close()
+
+
+def pilot_startup(port, script_path):
+    driver = ptyrc.driver.spawn_headless(["sh"], start_port=port)
+    try:
+        time.sleep(1)  # (driver is ready, see driver_startup)
+
+        env = dict(os.environ, PTYRC_START_PORT=str(port), PTYRC_PORT_RANGE="1")
+        argv = [sys.executable, "-c", "from ptyrc.pilot import main; main()"]
+
+        started = time.perf_counter()
+        pilot = subprocess.Popen(
+            argv + [script_path], env=env, stdout=subprocess.PIPE, text=True
+        )
+        line = pilot.stdout.readline()
+        elapsed = time.perf_counter() - started
+        pilot.wait(timeout=10)
+
+        assert line.strip() == "connected"
+        return elapsed
+    finally:
+        driver.close()
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    port = common.start_port + 3000
+
+    baseline, _ = import_time("sys", repeat)
+    print(f"{'python -c pass':>22}: {baseline * 1000:7.1f} ms")
+    for module in ["ptyrc", "ptyrc.common", "ptyrc.pilot", "ptyrc.driver"]:
+        elapsed, loaded = import_time(module, repeat)
+        extra = (elapsed - baseline) * 1000
+        print(f"{'import ' + module:>22}: {extra:+7.1f} ms (loads {loaded})")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py") as script:
+        script.write(pilot_script)
+        script.flush()
+
+        for name, func in [
+            ("ptyrc-driver", lambda p: driver_startup(p)),
+            ("ptyrc-pilot", lambda p: pilot_startup(p, script.name)),
+        ]:
+            timings = [func(port + i) for i in range(repeat)]
+            print(
+                f"{name + ' connected':>22}: {min(timings) * 1000:7.1f} ms "
+                f"(median {sorted(timings)[len(timings) // 2] * 1000:.1f} ms)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Microbenchmarks of charspec / linespec encode, decode and render.
+
+Reports ns/cell and memory per cell (net allocated blocks, and peak traced
+bytes) with cold and warm caches, for monochrome and 24-bit color lines of
+several widths.
+
+Usage: python3 bench/termcap.py [repeat]
+"""
+
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from pyte.screens import Char
+
+import ptyrc.termcap as termcap
+from ptyrc.termcap import ansiseq, charspec, linespec
+
+widths = [80, 250, 1000]
+
+
+def pyte_line(width, colored, seed=0):
+    rng = random.Random(seed)
+
+    def _rgb():
+        return "%02x%02x%02x" % (
+            rng.randrange(256),
+            rng.randrange(256),
+            rng.randrange(256),
+        )
+
+    line = []
+    for _ in range(width):
+        data = chr(rng.randint(0x21, 0x7E))
+        if colored:
+            line.append(Char(data=data, fg=_rgb(), bg=_rgb(), bold=rng.random() < 0.1))
+        else:
+            line.append(Char(data=data))
+    return line
+
+
+def measure(func, ncells, repeat, cold):
+    """returns (ns/cell, blocks/cell, peak bytes/cell) of func()"""
+
+    best = None
+    for _ in range(repeat):
+        if cold:
+            termcap.clear_caches()
+        gc.collect()
+        start = time.perf_counter_ns()
+        func()
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    if cold:
+        termcap.clear_caches()
+    gc.collect()
+    gc.disable()
+    try:
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sys.getallocatedblocks() - blocks
+        del result
+    finally:
+        gc.enable()
+
+    return best / ncells, blocks / ncells, peak / ncells
+
+
+def cases(width, colored):
+    line = pyte_line(width, colored)
+    chars = [charspec.from_pyte_char(c) for c in line]
+    packed = [c.pack() for c in chars]
+    spec = linespec(chars)
+
+    yield "from_pyte_char", lambda: [charspec.from_pyte_char(c) for c in line]
+    yield "pack", lambda: [c.pack() for c in chars]
+    yield "unpack", lambda: [charspec.unpack(p) for p in packed]
+    yield "linespec", lambda: linespec(chars)
+    yield "render", lambda: spec.render()
+    yield "render+cursor", lambda: spec.render(cursor_at=width // 2)
+    yield "render (new)", lambda: linespec(chars).render()
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    ansiseq.initialize()
+
+    print(
+        f"{'case':>16} {'line':>10} {'cache':>5} {'ns/cell':>9} "
+        f"{'blocks/cell':>11} {'peak B/cell':>11}"
+    )
+    for colored in [False, True]:
+        for width in widths:
+            kind = f"{'rgb' if colored else 'mono'}x{width}"
+            for name, func in cases(width, colored):
+                for cold in [True, False]:
+                    ns, blocks, peak = measure(func, width, repeat, cold)
+                    cache = "cold" if cold else "warm"
+                    print(
+                        f"{name:>16} {kind:>10} {cache:>5} {ns:9.0f} "
+                        f"{blocks:11.2f} {peak:11.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
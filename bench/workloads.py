@@ -0,0 +1,140 @@
+"""Deterministic terminal workloads, run as the child of a benchmarked driver.
+
+Usage: python3 -m bench.workloads <name> [seconds_or_megabytes]
+
+Each workload waits for a first line on stdin (the "go" of the benchmark
+pilot), then writes its output and exits.
+"""
+
+import os
+import random
+import shutil
+import sys
+import termios
+import time
+import tty
+
+
+def _write(data):
+    view = memoryview(data)
+    while view:
+        n = os.write(sys.stdout.fileno(), view)
+        view = view[n:]
+
+
+def _text(rng, width):
+    return bytes(rng.randint(0x21, 0x7E) for _ in range(width))
+
+
+def bulk(megabytes=20):
+    """dump text as fast as possible"""
+
+    rng = random.Random(0)
+    lines = [_text(rng, 79) + b"\r\n" for _ in range(256)]
+    block = b"".join(lines)
+
+    todo = int(megabytes * 1024 * 1024)
+    while todo > 0:
+        _write(block[:todo])
+        todo -= len(block)
+
+
+def redraw(seconds=3, fps=60):
+    """full-screen redraw, fps times per second"""
+
+    rng = random.Random(0)
+    nbcols, nbrows = shutil.get_terminal_size()
+    frames = [
+        b"\x1b[H" + b"\r\n".join(_text(rng, nbcols) for _ in range(nbrows))
+        for _ in range(8)
+    ]
+
+    started = time.time()
+    for frameno in range(int(seconds * fps)):
+        _write(frames[frameno % len(frames)])
+        delay = started + (frameno + 1) / fps - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def scroll(seconds=3, rate=2000):
+    """scrolling log, rate lines per second"""
+
+    rng = random.Random(0)
+    lines = [b"[%06d] " % i + _text(rng, 60) + b"\r\n" for i in range(1024)]
+
+    started = time.time()
+    lineno = 0
+    while time.time() - started < seconds:
+        batch = max(int((time.time() - started) * rate) - lineno, 1)
+        _write(b"".join(lines[(lineno + i) % len(lines)] for i in range(batch)))
+        lineno += batch
+        time.sleep(0.005)
+
+
+def color(seconds=3, fps=30):
+    """full-screen 24-bit color (one color per cell)"""
+
+    rng = random.Random(0)
+    nbcols, nbrows = shutil.get_terminal_size()
+
+    def _frame():
+        rows = []
+        for _ in range(nbrows):
+            row = b""
+            for _ in range(nbcols):
+                fg = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+                bg = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+                row += b"\x1b[38;2;%d;%d;%dm\x1b[48;2;%d;%d;%dm" % (fg + bg)
+                row += bytes([rng.randint(0x21, 0x7E)])
+            rows.append(row + b"\x1b[0m")
+        return b"\x1b[H" + b"\r\n".join(rows)
+
+    frames = [_frame() for _ in range(4)]
+
+    started = time.time()
+    for frameno in range(int(seconds * fps)):
+        _write(frames[frameno % len(frames)])
+        delay = started + (frameno + 1) / fps - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def echo(seconds=30):
+    """echo keystrokes back (raw mode) until ^D or timeout"""
+
+    mode = termios.tcgetattr(sys.stdin.fileno())
+    tty.setraw(sys.stdin.fileno())
+    try:
+        started = time.time()
+        while time.time() - started < seconds:
+            data = os.read(sys.stdin.fileno(), 1024)
+            if not data or b"\x04" in data:
+                break
+            _write(data.replace(b"\r", b"\r\n"))
+    finally:
+        termios.tcsetattr(sys.stdin.fileno(), termios.TCSAFLUSH, mode)
+
+
+workloads = dict(bulk=bulk, redraw=redraw, scroll=scroll, color=color, echo=echo)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in workloads:
+        print(f"Usage: {sys.argv[0]} {{{','.join(workloads)}}} [amount]")
+        sys.exit(1)
+
+    workload = workloads[sys.argv[1]]
+    kwargs = dict()
+    if len(sys.argv) > 2:
+        amount = float(sys.argv[2])
+        kwargs = dict(megabytes=amount) if workload is bulk else dict(seconds=amount)
+
+    # wait for go
+    if workload is not echo:
+        sys.stdin.readline()
+    workload(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
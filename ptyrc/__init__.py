@@ -1,4 +1,28 @@
-import ptyrc.common
-import ptyrc.driver
-import ptyrc.pilot
-import ptyrc.termcap
+import importlib
+
+# submodules are imported on first access (ptyrc.driver, ptyrc.pilot...)
+_submodules = [
+    "aio",
+    "batch",
+    "cellgrid",
+    "common",
+    "driver",
+    "fake_pty",
+    "fleet",
+    "matcher",
+    "metrics",
+    "pilot",
+    "render",
+    "screen",
+    "termcap",
+]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f"ptyrc.{name}")
+    raise AttributeError(f"module 'ptyrc' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import socket
+import time
+
+import ptyrc.common as common
+import ptyrc.pilot as pilot
+from ptyrc.common import verbose
+
+
+class stream_remote:
+    """socket-like end of an asyncio stream, as used by send_to_remote"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def sendall(self, raw):
+        self.writer.write(raw)  # (buffered, see async_pilot.input)
+
+    def shutdown(self, how=None):
+        if self.writer.can_write_eof():
+            self.writer.write_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class async_handler(pilot.server_handler):
+    """server_handler fed by the event loop, waking up coroutines (instead
+    of threads) each time lines, values, matches or frames arrive"""
+
+    def __init__(self, backend, remote, version=common.version):
+        self.updated = asyncio.Event()
+        super().__init__(backend, remote, version=version)
+
+    def wakeup(self):
+        super().wakeup()
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def argv_cmd(self, new_argv):
+        super().argv_cmd(new_argv)
+        self.wakeup()
+
+    def match(self, name, start, end, text, truncated=False):
+        super().match(name, start, end, text, truncated)
+        self.wakeup()
+
+    def stable(self, token, frame):
+        super().stable(token, frame)
+        self.wakeup()
+
+
+class async_pilot:
+    """pilot of one driver, driven from an asyncio event loop
+
+    one loop may drive many sessions, each one being a reader task (no
+    threads involved); the API mirrors pilot_frontend, with coroutines
+    for everything that waits
+    """
+
+    def __init__(self, timeout=3, version=common.version):
+        self.timeout = timeout
+        self.version = version
+
+        self.active_handler = None
+        self.reader = None
+        self.port = None
+
+    @property
+    def connected(self):
+        if self.active_handler is None:
+            return False
+        return self.active_handler.is_alive()
+
+    @property
+    def handler(self):
+        if self.active_handler is None or self.active_handler.finished:
+            raise ConnectionError("not connected to a driver")
+        return self.active_handler
+
+    @property
+    def argv(self):
+        return self.handler.values.get("argv_cmd")
+
+    @property
+    def pid(self):
+        return self.handler.values.get("child_pid")
+
+    @property
+    def tag(self):
+        return self.handler.values.get("tag")
+
+    @property
+    def cursor(self):
+        return self.handler.values.get("cursor_position")
+
+    @property
+    def size(self):
+        return self.handler.values.get("terminal_size")
+
+    def text_at(self, row_number, rstrip=" "):
+        display = self.handler.display
+        if row_number > len(display):
+            return None
+
+        row = display[row_number - 1]
+        if rstrip:
+            row = row.rstrip(rstrip)
+        return row
+
+    async def connect(
+        self,
+        port=None,
+        *,
+        start_port=common.start_port,
+        port_range=common.port_range,
+    ):
+        """connect to the driver on port, or to the first one found"""
+
+        ports = (
+            [port] if port is not None else range(start_port, start_port + port_range)
+        )
+        for portno in ports:
+            verbose(f" - trying {portno}")
+            try:
+                await self.open(portno)
+                return self
+            except (OSError, TimeoutError, asyncio.TimeoutError):
+                await self.close()
+
+        raise ConnectionError("no driver to be found")
+
+    async def open(self, portno, probe=1):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection("localhost", portno), probe
+        )
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            # (probing a free port may connect the socket to itself)
+            if sock.getsockname() == sock.getpeername():
+                writer.close()
+                raise ConnectionRefusedError(f"no driver on {portno}")
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # (sets self.active_handler, as pilot_backend.active_handler)
+        handler = async_handler(self, stream_remote(writer), version=self.version)
+        handler.send(what="get_version", data=self.version)
+        self.reader = asyncio.ensure_future(self.read_loop(reader, handler))
+        self.port = portno
+
+        # (drivers busy with another pilot accept, but never answer)
+        deadline = time.time() + probe
+        while handler.values.get("terminal_size") is None:
+            await self.updated(handler, deadline, f"no answer on {portno}")
+
+    async def read_loop(self, reader, handler):
+        """(task) dispatch incoming payloads to handler, until disconnected"""
+
+        try:
+            while not handler.finished:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    payload = json.loads(line)
+                except json.JSONDecodeError:
+                    verbose(f"Ill-formed incoming data: {line}")
+                    continue
+                common.dispatch(handler, payload)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            verbose(f"\n\r -> Connection closed :/ ({type(e)} {e})")
+        finally:
+            handler.last_ping = 0
+            handler.finished = True
+            handler.wakeup()
+
+    async def close(self):
+        handler, self.active_handler = self.active_handler, None
+        if handler is not None:
+            handler.finished = True
+            handler.remote.close()
+            try:
+                await handler.remote.writer.wait_closed()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        if self.reader is not None:
+            self.reader.cancel()
+            self.reader = None
+
+    async def updated(self, handler, deadline, reason):
+        """wait for the next update of handler, or raise TimeoutError"""
+
+        remaining = deadline - time.time()
+        if remaining <= 0 or handler.finished:
+            raise TimeoutError(reason)
+
+        try:
+            await asyncio.wait_for(handler.updated.wait(), remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutError(reason) from None
+
+    async def input(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+
+        handler = self.handler
+        handler.send(what="write_to_tty", data=data)
+        await handler.remote.writer.drain()
+
+    async def wait_for(self, pattern, region=None, timeout=None):
+        """wait for pattern to show on screen (see pilot_frontend.wait_for)"""
+
+        handler = self.handler
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        rows = set()
+        handler.watchers[id(rows)] = rows
+        try:
+            found = pilot.search_rows(handler.display, pattern, region=region)
+            while found is None:
+                while not rows:
+                    await self.updated(
+                        handler, deadline, f"{pattern!r} not found on screen"
+                    )
+                changed = set(rows)
+                rows.clear()
+                found = pilot.search_rows(handler.display, pattern, changed, region)
+        finally:
+            del handler.watchers[id(rows)]
+        return found
+
+    async def wait_until_stable(self, quiet=0.05, timeout=None):
+        """wait until the screen went unchanged for quiet seconds (see
+        pilot_frontend.wait_until_stable), returns the driver frame number"""
+
+        handler = self.handler
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        token = f"{id(self)}-{time.time()}"
+        handler.stable_frames[token] = None
+        handler.send(what="wait_stable", data=dict(token=token, quiet=quiet))
+
+        try:
+            while handler.stable_frames[token] is None:
+                await self.updated(handler, deadline, f"screen not stable for {quiet}s")
+            return handler.stable_frames[token]
+        finally:
+            del handler.stable_frames[token]
+
+    async def snapshot(self, quiet=None, timeout=None):
+        """current display, as a screen_version (see pilot_frontend.snapshot)
+
+        with quiet, waits first for the screen to be stable for quiet seconds
+        """
+
+        if quiet is not None:
+            await self.wait_until_stable(quiet=quiet, timeout=timeout)
+
+        handler = self.handler
+        with handler.changed:
+            handler.freeze(force=not handler.history)
+            return handler.history[-1]
+
+
+async def connect(port=None, *, timeout=3, **kwargs):
+    """async_pilot connected to the driver on port (or the first found)"""
+
+    return await async_pilot(timeout=timeout).connect(port, **kwargs)
@@ -0,0 +1,244 @@
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+import traceback
+
+import ptyrc.common as common
+import ptyrc.driver as driver
+import ptyrc.pilot as pilot
+
+
+class batch_frontend(pilot.pilot_frontend):
+    """pilot of a batch job: quit ends the userscript, not the process"""
+
+    final_stats = None
+
+    def quit(self, exit_func=lambda: sys.exit(0)):
+        try:
+            self.final_stats = self.stats
+        except (TimeoutError, BrokenPipeError, ConnectionResetError):
+            pass
+        super().quit(exit_func=exit_func)
+
+
+def find_userscripts(path):
+    """userscripts of a batch: path itself, or every *.py file in it"""
+
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(glob.glob(os.path.join(path, "*.py")))
+
+
+def job_result(job, error=None):
+    """result of job, as reported (see run_batch)"""
+
+    return dict(
+        script=job["script"],
+        port=job["port"],
+        argv=None,
+        passed=False,
+        error=error,
+        traceback=None,
+        duration=None,
+        stats=None,
+        exit_code=None,
+    )
+
+
+def run_job(job, conn):
+    """(process) run one userscript against its driver, send back its result
+
+    the userscript gets a headless driver of its own if it defines argv
+    (module attribute) or if job["spawn"] is set, else it is paired with
+    the driver already listening on job["port"]
+    """
+
+    result = job_result(job)
+
+    def _timeout(signum, frame):
+        raise TimeoutError(f"timed out after {job['timeout']}s")
+
+    signal.signal(signal.SIGALRM, _timeout)
+    signal.setitimer(signal.ITIMER_REAL, job["timeout"])
+
+    headless = None
+    backend = None
+    frontend = None
+    started = time.time()
+    try:
+        userscript = pilot.load_userscript(job["script"])
+
+        argv = getattr(userscript, "argv", None) or job["spawn"]
+        if isinstance(argv, str):
+            argv = [argv]
+        if argv is not None:
+            result["argv"] = list(argv)
+            result["port"] = job["spawn_port"]
+            headless = driver.spawn_headless(argv, start_port=job["spawn_port"])
+
+        backend = pilot.pilot_backend(start_port=result["port"], port_range=1)
+        backend.setup_jobs()
+        for thread in backend.jobs:
+            thread.start()
+
+        frontend = batch_frontend(backend=backend, timeout=backend.timeout)
+        frontend.wait_for_driver(animated=False)
+        started = time.time()
+
+        result["passed"] = userscript.main(frontend) is not False
+        if not result["passed"]:
+            result["error"] = "main(pilot) returned False"
+
+    except SystemExit as e:
+        result["passed"] = e.code in (None, 0)
+        if not result["passed"]:
+            result["error"] = f"exit with code {e.code}"
+
+    except BaseException as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        result["duration"] = time.time() - started
+
+        if frontend is not None:
+            result["stats"] = frontend.final_stats
+            if result["stats"] is None and frontend.connected:
+                try:
+                    result["stats"] = frontend.stats
+                except (TimeoutError, BrokenPipeError, ConnectionResetError):
+                    pass
+
+        # (exit code of the wrapped child, if it exited before teardown;
+        # drivers send its wait status, as returned by pty.spawn)
+        if backend is not None and backend.active_handler is not None:
+            status = backend.active_handler.exit_code
+            if status is not None:
+                result["exit_code"] = os.waitstatus_to_exitcode(status)
+        if headless is not None and result["exit_code"] is None:
+            result["exit_code"] = headless.poll()
+
+        if backend is not None:
+            backend.finished = True
+            if backend.active_handler is not None:
+                try:
+                    backend.active_handler.close("batch job done")
+                except BrokenPipeError:
+                    pass
+
+        if headless is not None:
+            headless.close()
+
+        conn.send(result)
+        conn.close()
+
+
+def run_batch(
+    scripts,
+    *,
+    jobs=None,
+    timeout=300,
+    spawn=None,
+    start_port=common.start_port,
+    port_range=common.port_range,
+    grace=10,
+    log=sys.stderr,
+):
+    """run userscripts concurrently, jobs at once, each one in a process
+
+    the n-th userscript is paired with the driver listening on start_port
+    + n, or with a headless driver of its own listening on start_port +
+    port_range + n (see run_job); processes of userscripts still running
+    timeout + grace seconds after their start are killed
+
+    returns the report, as dict(summary, results)
+    """
+
+    jobs = jobs or os.cpu_count()
+    pending = [
+        dict(
+            script=script,
+            port=start_port + index,
+            spawn=spawn,
+            spawn_port=start_port + port_range + index,
+            timeout=timeout,
+        )
+        for index, script in enumerate(scripts)
+    ]
+
+    started = time.time()
+    running = []
+    results = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            job = pending.pop(0)
+            recv, send = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=run_job, args=(job, send), daemon=True
+            )
+            process.start()
+            send.close()
+            running.append((job, process, recv, time.time() + timeout + grace))
+
+        multiprocessing.connection.wait(
+            [recv for _, _, recv, _ in running], timeout=0.1
+        )
+
+        for entry in list(running):
+            job, process, recv, deadline = entry
+
+            result = None
+            if recv.poll():
+                try:
+                    result = recv.recv()
+                except EOFError:  # (died before sending its result)
+                    pass
+            elif process.is_alive() and time.time() < deadline:
+                continue
+
+            if result is None:
+                if process.is_alive():
+                    process.kill()
+                    error = f"killed after {timeout + grace}s"
+                else:
+                    error = f"process exit with code {process.exitcode}"
+                result = job_result(job, error=error)
+
+            process.join()
+            recv.close()
+            running.remove(entry)
+            results.append(result)
+
+            if log is not None:
+                status = "pass" if result["passed"] else "FAIL"
+                duration = result["duration"] or 0
+                print(f"{status} {result['script']} ({duration:.2f}s)", file=log)
+                if not result["passed"]:
+                    print(f"     {result['error']}", file=log)
+
+    passed = sum(1 for result in results if result["passed"])
+    summary = dict(
+        total=len(results),
+        passed=passed,
+        failed=len(results) - passed,
+        jobs=jobs,
+        duration=time.time() - started,
+    )
+    results.sort(key=lambda result: result["script"])
+    return dict(summary=summary, results=results)
+
+
+def write_report(report, path=None):
+    if path is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,151 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ptyrc.termcap import bg_is256_flag, charspec, fg_is256_flag, flag_bits
+
+# one cell, exactly as charspec.pack() lays it out (packed_size bytes)
+if numpy is not None:
+    cell_dtype = numpy.dtype(
+        [
+            ("flags", "u1"),
+            ("fg", "u1", 3),
+            ("bg", "u1", 3),
+            ("datasz", "u1"),
+            ("data", "S%d" % charspec.datamaxsz),
+        ]
+    )
+    assert cell_dtype.itemsize == charspec.packed_size
+else:
+    cell_dtype = None
+
+
+def available():
+    return numpy is not None
+
+
+cache_size = 1 << 15  # (packed cells cached, see pack_row)
+
+
+class packed_cells(dict):
+    """pyte char -> packed cell (see charspec.pack), filled on first use"""
+
+    def __missing__(self, pyte_char):
+        if len(self) >= cache_size:
+            self.clear()
+
+        packed = charspec.from_pyte_char(pyte_char).pack()
+        self[pyte_char] = packed
+        return packed
+
+
+_packed_cells = packed_cells()
+
+
+def pack_row(cells):
+    """pyte chars -> packed row, with one (C-level) dict lookup per cell"""
+    return b"".join(map(_packed_cells.__getitem__, cells))
+
+
+class cellgrid:
+    """(nbrows, nbcols) array of packed cells, kept in sync row by row"""
+
+    def __init__(self, terminal_size):
+        if numpy is None:
+            raise RuntimeError("cellgrid requires numpy")
+
+        nbcols, nbrows = terminal_size
+        self.size = (nbcols, nbrows)
+        self.cells = numpy.zeros((nbrows, nbcols), dtype=cell_dtype)
+        self.rows = [None] * nbrows  # (snapshot rows held, see sync)
+
+        # decoded characters, refreshed on demand (see as_arrays)
+        self.chars = numpy.zeros((nbrows, nbcols), dtype="U%d" % charspec.datamaxsz)
+        self.stale_rows = set(range(nbrows))
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        grid = cls(snapshot.size)
+        grid.update(snapshot, range(len(snapshot.cells)))
+        return grid
+
+    def resized(self, terminal_size):
+        """copy of the grid with another size (cropped, or padded)"""
+
+        grid = cellgrid(terminal_size)
+        nbcols = min(self.size[0], grid.size[0])
+        nbrows = min(self.size[1], grid.size[1])
+        grid.cells[:nbrows, :nbcols] = self.cells[:nbrows, :nbcols]
+        return grid
+
+    def set_row(self, lineno, packed):
+        """replace a row with packed cells (as sent by set_rawline)"""
+
+        row = numpy.frombuffer(packed, dtype=cell_dtype)
+        nbcols = self.size[0]
+        if len(row) < nbcols:
+            self.cells[lineno, len(row) :] = numpy.zeros(1, dtype=cell_dtype)
+        self.cells[lineno, : len(row)] = row[:nbcols]
+        self.stale_rows.add(lineno)
+
+    def update(self, snapshot, linelist, spans=None):
+        """update given rows (or only their spans of columns) from a snapshot"""
+
+        spans = spans or dict()
+        for lineno in linelist:
+            if lineno >= min(len(snapshot.cells), self.size[1]):
+                continue
+
+            row = snapshot.cells[lineno]
+            start, end = spans.get(lineno, (0, len(row)))
+            end = min(end, self.size[0])
+            packed = pack_row(row[start:end])
+            self.cells[lineno, start:end] = numpy.frombuffer(packed, dtype=cell_dtype)
+            self.rows[lineno] = row
+            self.stale_rows.add(lineno)
+
+    def sync(self, snapshot, linelist):
+        """update given rows that differ from those of snapshot"""
+
+        cells = snapshot.cells
+        self.update(
+            snapshot,
+            [
+                lno
+                for lno in linelist
+                if lno < len(cells)
+                and lno < self.size[1]
+                and self.rows[lno] is not cells[lno]
+            ],
+        )
+
+    def pack_rows(self, linelist):
+        """rows -> dict of packed rows (wire format of set_rawline)"""
+
+        nbrows = self.size[1]
+        return {lno: self.cells[lno].tobytes() for lno in linelist if lno < nbrows}
+
+    def as_arrays(self):
+        """copies of the grid as arrays: chars, fg, bg, flags & one boolean
+        array per flag; colors are (r, g, b) if fg/bg_is256, else (code, 0, 0)
+        """
+
+        rows = sorted(lno for lno in self.stale_rows if lno < self.size[1])
+        if rows:
+            data = self.cells["data"][rows]
+            self.chars[rows] = numpy.char.decode(data, "utf-8")
+            self.stale_rows = set()
+
+        flags = self.cells["flags"].copy()
+        arrays = dict(
+            chars=self.chars.copy(),
+            fg=self.cells["fg"].copy(),
+            bg=self.cells["bg"].copy(),
+            flags=flags,
+            fg_is256=(flags & fg_is256_flag) != 0,
+            bg_is256=(flags & bg_is256_flag) != 0,
+        )
+        for name, bit in flag_bits.items():
+            arrays[name] = (flags & bit) != 0
+        return arrays
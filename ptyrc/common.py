@@ -1,15 +1,14 @@
 import json
+import os
 import sys
 import time
 from base64 import b64decode, b64encode
 
-import ptyrc.fake_pty as fake_pty
-
 version = (1, 0, 0)
-start_port = 34012
-port_range = 10
+start_port = int(os.environ.get("PTYRC_START_PORT", 34012))
+port_range = int(os.environ.get("PTYRC_PORT_RANGE", 10))
 
-global_buffer_size = fake_pty.BUFFER_SIZE
+global_buffer_size = 1024  # (fake_pty.BUFFER_SIZE, without importing it)
 larger_buffer_size = global_buffer_size * 4 * 2
 
 verbose_logs = False
@@ -28,6 +27,7 @@ class basic_handler:
         self.finished = False
         self.last_ping = 0
         self.exit_code = None
+        self.values = dict()
 
     def is_alive(self):
         return (
@@ -95,8 +95,6 @@ class basic_handler:
     # default value handlers (to be overriden if needed)
     #
 
-    values = dict()
-
     def cursor_position(self, new_position):
         # verbose(f'cursor_position {new_position}')
         self.values["cursor_position"] = new_position
@@ -109,6 +107,15 @@ class basic_handler:
         # verbose(f'argv_cmd {new_argv}')
         self.values["argv_cmd"] = new_argv
 
+    def child_pid(self, new_pid):
+        self.values["child_pid"] = new_pid
+
+    def tag(self, new_tag):
+        self.values["tag"] = new_tag
+
+    def stats(self, **new_stats):
+        self.values["stats"] = new_stats
+
     #
     # default stdin / stdout handlers (does nothing)
     #
@@ -131,6 +138,7 @@ def send_to_remote(remote, what, data):
     raw = json.dumps(rq) + "\n"
     assert len(raw) < larger_buffer_size
     remote.sendall(raw.encode())
+    return len(raw)
 
 
 def recv_from_remote(remote, attempts=20):
@@ -179,28 +187,34 @@ def handle_remote(remote, handler, *, maxfails=10):
             continue
 
         for payload in payloads:
-            if not isinstance(payload, dict):
-                verbose(f"Unhandled raw data: {payload}")
-                continue
+            dispatch(handler, payload)
 
-            if "what" not in payload or "data" not in payload:
-                verbose(f"Ill-formed incoming data: {payload}")
-                continue
 
-            method = getattr(handler, payload["what"], None)
-            if method is None:
-                verbose(f'Unknown {payload["what"]} here:\n\r {payload}')
-                continue
+def dispatch(handler, payload):
+    """call the method of handler named by one incoming payload"""
 
-            data = payload["data"]
-            if isinstance(data, dict) and len(data) == 1 and "base64" in data:
-                data = b64decode(data["base64"])
+    if not isinstance(payload, dict):
+        verbose(f"Unhandled raw data: {payload}")
+        return
 
-            if data is None:
-                verbose(f'Null data (None) was send for {payload["what"]}')
-                continue
+    if "what" not in payload or "data" not in payload:
+        verbose(f"Ill-formed incoming data: {payload}")
+        return
+
+    method = getattr(handler, payload["what"], None)
+    if method is None:
+        verbose(f'Unknown {payload["what"]} here:\n\r {payload}')
+        return
+
+    data = payload["data"]
+    if isinstance(data, dict) and len(data) == 1 and "base64" in data:
+        data = b64decode(data["base64"])
+
+    if data is None:
+        verbose(f'Null data (None) was send for {payload["what"]}')
+        return
 
-            if isinstance(data, dict):
-                method(**data)
-            else:
-                method(data)
+    if isinstance(data, dict):
+        method(**data)
+    else:
+        method(data)
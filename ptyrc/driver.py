@@ -1,21 +1,21 @@
 import atexit
 import fcntl
 import os
-import select
+import re
 import shutil
 import signal
 import socket
 import struct
-import subprocess
 import sys
 import termios
 import threading
 import time
-import tty
 
 import ptyrc.common as common
 import ptyrc.fake_pty as fake_pty
-import ptyrc.screen
+import ptyrc.matcher as matcher
+import ptyrc.metrics as metrics
+import ptyrc.termcap as termcap
 from ptyrc.common import verbose
 from ptyrc.termcap import ansiseq, charspec
 
@@ -27,16 +27,48 @@ class client_handler(common.basic_handler):
         "cursor_position",
         "has_smcup",
         "first_write",
+        "child_pid",
+        "tag",
     ]
-    values_from_self = []
+    # (value name -> method of this handler computing it)
+    values_from_self = {"stats": "current_stats"}
 
     def __init__(self, parent, remote, version=common.version):
         super().__init__(remote=remote, version=version)
         self.parent = parent
+        self.counters = metrics.counters(
+            "messages_sent", "bytes_sent", "lines_sent", "rawlines_sent"
+        )
+
+    def current_stats(self):
+        """session stats, plus the counters of this client"""
+        return dict(self.parent.get_stats(), client=self.counters.as_dict())
+
+    def send(self, what, data):
+        nbytes = common.send_to_remote(self.remote, what, data)
+        self.counters.incr("messages_sent")
+        self.counters.incr("bytes_sent", nbytes or 0)
 
     def kill(self, code):
         os._exit(code)
 
+    def watch(self, name, pattern, regex=False, flags=0, binary=False):
+        """send a "match" each time pattern shows in the child output"""
+
+        try:
+            self.parent.matcher.add(
+                name, pattern, regex=regex, flags=flags, binary=binary
+            )
+        except re.error as e:
+            verbose(f"Invalid pattern {pattern!r}: {e}")
+
+    def unwatch(self, name):
+        self.parent.matcher.remove(name)
+
+    def wait_stable(self, token, quiet):
+        """send "stable" once the screen went unchanged for quiet seconds"""
+        self.parent.stable_waiters[token] = quiet
+
     def get_value(self, value_name):
         if value_name in self.values_from_parent:
             value = getattr(self.parent, value_name)
@@ -44,7 +76,7 @@ class client_handler(common.basic_handler):
                 self.send(what=value_name, data=value)
 
         elif value_name in self.values_from_self:
-            value = getattr(self, value_name)
+            value = getattr(self, self.values_from_self[value_name])()
             if value is not None:
                 self.send(what=value_name, data=value)
 
@@ -96,34 +128,57 @@ class client_handler(common.basic_handler):
         verbose(f"Unknown command: {command_name}")
         return
 
-    def get_lines(self, linelist):
+    def get_lines(self, linelist, snapshot=None):
         if self.parent.terminal is None:
             return
-        display = self.parent.terminal.display
+        # (only streamed frames are traced, not refreshes of old ones)
+        extra = self.trace_of(snapshot)
+        snapshot = snapshot or self.parent.terminal.snapshot()
+        display = snapshot.display
+
+        if self.parent._cfg_frame_numbers:
+            extra.update(frame=snapshot.frame)
 
         linelist.sort()
         linelist = [lno for lno in linelist if lno < len(display)]
         for lineno in linelist:
-            self.send(what="set_line", data=dict(where=lineno, line=display[lineno]))
+            self.send(
+                what="set_line", data=dict(where=lineno, line=display[lineno], **extra)
+            )
+        self.counters.incr("lines_sent", len(linelist))
 
-    def get_rawlines(self, linelist):
+    def get_rawlines(self, linelist, snapshot=None):
         if self.parent.terminal is None:
             return
 
-        raw_lines = self.parent.terminal.get_raw_lines(linelist)
-        for lineno, linedata in raw_lines.items():
-            packedline = b""
-            for raw_char in linedata:
-                packedline += raw_char.pack()
+        extra = self.trace_of(snapshot)
+
+        if self.parent._cfg_rawline_runs:
+            extra.update(encoding=2)
 
+        packed_lines = self.parent.terminal.get_packed_lines(linelist, snapshot)
+        for lineno, packedline in packed_lines.items():
+            if self.parent._cfg_rawline_runs:
+                packedline = termcap.pack_runs(packedline)
             serialized_line = common.b64encode(packedline).decode()
             self.send(
-                what="set_rawline", data=dict(where=lineno, rawline=serialized_line)
+                what="set_rawline",
+                data=dict(where=lineno, rawline=serialized_line, **extra),
             )
+        self.counters.incr("rawlines_sent", len(packed_lines))
+
+    def trace_of(self, snapshot):
+        """extra fields of line updates when tracing (see pilot latency)"""
+
+        if snapshot is None or snapshot.trace is None or not self.parent._cfg_trace:
+            return dict()
+        return dict(trace=dict(snapshot.trace, send=time.time()))
 
     def write_to_tty(self, input_bytes):
         if self.parent.child_fd is not None:
             os.write(self.parent.child_fd, input_bytes)
+            self.parent.counters.incr("bytes_written", len(input_bytes))
+            self.parent.last_activity = time.time()
 
     def draw(self, where, char, attrs=None):
         if not ansiseq.ready:
@@ -153,6 +208,9 @@ class pty_driver:
         port_range=common.port_range,
         maxfails=10,
         version=common.version,
+        stats_file=None,
+        stats_period=10,
+        tag=None,
     ):
         ansiseq.initialize()
 
@@ -161,9 +219,16 @@ class pty_driver:
         self.port_range = port_range
         self.maxfails = maxfails
         self.version = version
+        self.tag = tag  # (free-form label for pilots, see fleet.select)
+
+        self.stats_file = stats_file
+        self.stats_period = stats_period
+        self.started = time.time()
+        self.counters = metrics.counters("bytes_read", "bytes_written", "bytes_sent")
 
         self.jobs = []
         self.child_fd = -1
+        self.child_pid = None
 
         self.handler = None
         self.active_client = None
@@ -172,6 +237,7 @@ class pty_driver:
 
         self.cursor_moved = False
         self.first_write = None
+        self.first_output = threading.Event()  # (set with first_write)
         self.early_buffer = b""
         self.has_smcup = False
 
@@ -183,10 +249,29 @@ class pty_driver:
         self._cfg_stream_rawlines = False
         self._cfg_stream_stdout = False
         self._cfg_stream_stdin = False
+        self._cfg_trace = False
+        self._cfg_rawline_runs = False
+        self._cfg_frame_numbers = False
+
+        # patterns watched by the client on the child output (see watch)
+        self.matcher = matcher.stream_matcher()
+
+        # last input, output or screen update (see notify_stable)
+        self.last_activity = time.time()
+        self.stable_waiters = dict()
 
         self.finished = False
 
     def handle_client(self, client, addr, maxfails=None):
+        self.matcher.clear()
+        self.stable_waiters.clear()
+
+        # (options negotiated by a previous client, unknown to older ones)
+        self._cfg_stream_rawlines = False
+        self._cfg_rawline_runs = False
+        self._cfg_frame_numbers = False
+        self._cfg_trace = False
+
         self.handler = client_handler(self, client, version=self.version)
         common.handle_remote(client, self.handler, maxfails=maxfails or self.maxfails)
 
@@ -215,7 +300,10 @@ class pty_driver:
                 exit_func()
 
             # try binding
+            # (ports left in TIME_WAIT by a previous client, or by a pilot
+            # probing the port before it was bound, are still ours)
             server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             try:
                 server.bind(("localhost", start_port))
                 server.listen(1)
@@ -230,6 +318,7 @@ class pty_driver:
             # accept client & give control handle_client for babysitting
             try:
                 remote, addr = server.accept()
+                remote.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.active_client = remote
                 self.handle_client(remote, addr)
             except (BrokenPipeError, ConnectionResetError) as e:
@@ -262,9 +351,14 @@ class pty_driver:
         """helper that sends data to client iff it exists (+hide exceptions)"""
 
         try:
-            common.send_to_remote(self.active_client, what, data)
+            nbytes = common.send_to_remote(self.active_client, what, data)
+            self.counters.incr("bytes_sent", nbytes or 0)
+
+        # (payload too large, or not serializable: drop it, not the caller)
+        except (AssertionError, TypeError, ValueError) as e:
+            verbose(f"Unable to send {what}: {type(e)} {e}")
 
-        except BrokenPipeError:
+        except OSError:  # (BrokenPipeError, ConnectionResetError...)
 
             # (try again to shutdown, just in case)
             if self.active_client is not None:
@@ -312,6 +406,8 @@ class pty_driver:
 
         # when terminal size is first known, create terminal of the right size
         if self.terminal is None and self.terminal_size is not None:
+            import ptyrc.screen  # (pulls pyte, only needed once running)
+
             self.terminal = ptyrc.screen.screen(self.terminal_size)
 
     def cursor_poller(self, poll=0.01):
@@ -341,13 +437,65 @@ class pty_driver:
                 last_ping = time.time()
                 self.send_to_client(what="ping", data=time.time())
 
+    def get_stats(self):
+        """counters & gauges of this session (see client_handler.current_stats)"""
+
+        stats = self.counters.as_dict()
+        stats.update(
+            time=time.time(),
+            uptime=time.time() - self.started,
+            connected=self.active_client is not None,
+            early_buffer_bytes=len(self.early_buffer),
+            driver=metrics.rusage_self(),
+            caches=termcap.cache_stats(),
+        )
+        if self.child_pid is not None:
+            stats["child"] = metrics.rusage_pid(self.child_pid)
+
+        terminal = self.terminal
+        if terminal is not None:
+            stats.update(
+                frames=terminal.snapshot().frame,
+                emulation_seconds=terminal.emulation_time,
+                pending_bytes=terminal.pending_size,
+                pending_chunks=len(terminal.pending),
+                dropped_bytes=terminal.dropped_bytes,
+            )
+
+        handler = self.handler
+        if handler is not None:
+            stats["client"] = handler.counters.as_dict()
+        return stats
+
+    def stats_dumper(self):
+        """(thread) periodically dump stats to stats_file (prometheus format)"""
+
+        while not self.finished:
+            try:
+                metrics.dump_prometheus(self.get_stats(), self.stats_file)
+            except OSError as e:
+                verbose(f"Unable to dump stats: {type(e)} {e}")
+            time.sleep(self.stats_period)
+
     def stream_lines_callback(self, screen, dirty_lines, display):
-        if not self.handler:
+        if dirty_lines:
+            self.last_activity = time.time()
+
+        handler = self.handler
+        if not handler:
             return
-        if self._cfg_stream_lines:
-            self.handler.get_lines(dirty_lines)
-        if self._cfg_stream_rawlines:
-            self.handler.get_rawlines(dirty_lines)
+
+        # (both streams are sent from the same frame)
+        snapshot = screen.snapshot()
+        try:
+            if self._cfg_stream_lines:
+                handler.get_lines(list(dirty_lines), snapshot)
+            if self._cfg_stream_rawlines:
+                handler.get_rawlines(list(dirty_lines), snapshot)
+
+        # (client gone, server_loop waits for the next one: keep watching)
+        except OSError as e:
+            verbose(f"\n\r -> Unable to stream lines ({type(e)} {e})")
 
     def screen_watcher(self, poll=0.01):
         """(terminal) feed updates to virtual terminal, sends line updates to client"""
@@ -357,11 +505,36 @@ class pty_driver:
 
         while not self.finished:
             if not self.terminal.is_dirty:
+                self.notify_matches(quiet=poll * 2)
+                self.notify_stable()
                 time.sleep(poll)
                 continue
 
             self.terminal.flush(self.stream_lines_callback, clear=True)
 
+    def notify_matches(self, quiet):
+        """send matches held back at the end of the output, once it went
+        unchanged for quiet seconds (see stream_matcher.feed)"""
+
+        if not self.matcher.held or time.time() - self.last_activity < quiet:
+            return
+
+        for match in self.matcher.flush():
+            self.send_to_client(what="match", data=match)
+
+    def notify_stable(self):
+        """tell waiting clients that the screen went unchanged long enough"""
+
+        if not self.stable_waiters:
+            return
+
+        quiet_for = time.time() - self.last_activity
+        for token, quiet in list(self.stable_waiters.items()):
+            if quiet_for >= quiet and self.terminal.pending_size == 0:
+                del self.stable_waiters[token]
+                frame = self.terminal.snapshot().frame
+                self.send_to_client(what="stable", data=dict(token=token, frame=frame))
+
     #
     # fake_pty.spawn handlers
     #
@@ -370,16 +543,30 @@ class pty_driver:
         """(pty) monitor child_fd output, send to client, print to screen"""
 
         if stdout is not None:
-            out = os.read(stdout, common.global_buffer_size)
+            out = os.read(stdout, fake_pty.read_size(stdout))
+            self.counters.incr("bytes_read", len(out))
+            self.last_activity = time.time()
         else:
             out = b""
+        origin = time.time() if self._cfg_trace else None
 
         if self._cfg_stream_stdout:
-            self.send_to_client(what="stdout", data=out)
+            for start in range(0, len(out), common.global_buffer_size):
+                chunk = out[start : start + common.global_buffer_size]
+                self.send_to_client(what="stdout", data=chunk)
+
+        for match in self.matcher.feed(out):
+            self.send_to_client(what="match", data=match)
 
         # first second of stdout is buffered in early_buffer
-        self.first_write = self.first_write or time.time()
-        if abs(self.first_write - time.time()) < self.initial_latency:
+        # (or more, until the terminal exists: starting many drivers at
+        # once may take longer than initial_latency, see poll_termsize)
+        if self.first_write is None:
+            self.first_write = time.time()
+            self.first_output.set()
+        if self.terminal is None or (
+            abs(self.first_write - time.time()) < self.initial_latency
+        ):
             self.early_buffer += out
             return fake_pty.SKIP_STDOUT
 
@@ -407,7 +594,7 @@ class pty_driver:
         if out:
             self.cursor_moved = True
 
-        self.terminal.feed(out)
+        self.terminal.feed(out, origin=origin)
         if stdout is None:
             os.write(fake_pty.STDOUT_FILENO, out)
         return out
@@ -448,12 +635,14 @@ class pty_driver:
         # if stdin was only sequence, skip (without closing it)
         if not indata:
             return fake_pty.SKIP_STDIN
+        self.last_activity = time.time()
 
         # transmit data to client
         if self._cfg_stream_stdin:
             self.send_to_client(what="stdin", data=indata)
 
         # forward data to process
+        self.counters.incr("bytes_written", len(indata))
         return indata
 
     def setup_sigwinch(self):
@@ -487,9 +676,14 @@ class pty_driver:
             )
         )
 
-        # +call master_read in 1.1s to empty early_buffer
+        # +call master_read 1.1s after the first write to empty early_buffer
+        # (or later, if the terminal is late; never, if the child is silent)
         def _delayed():
-            time.sleep(self.initial_latency * 1.10)
+            self.first_output.wait()
+            elapsed = time.time() - self.first_write
+            time.sleep(max(self.initial_latency * 1.10 - elapsed, 0))
+            while self.terminal is None:
+                time.sleep(self.initial_latency * 0.10)
             self.master_read(None)
 
         jobs.append(
@@ -499,6 +693,15 @@ class pty_driver:
             )
         )
 
+        # +start thread dumping stats to a file (if requested)
+        if self.stats_file is not None:
+            jobs.append(
+                threading.Thread(
+                    target=lambda: self.stats_dumper(),
+                    daemon=True,
+                )
+            )
+
         # and finally, start thread handling networking / client connections
         jobs.append(
             threading.Thread(
@@ -536,6 +739,115 @@ class pty_driver:
         return self.spawn()
 
 
+#
+# headless drivers
+#
+
+
+class headless_driver:
+    """ptyrc-driver wrapping argv_cmd, run in a pty of its own (no terminal)"""
+
+    def __init__(self, argv_cmd, *, size=(80, 24), env=None):
+        self.argv_cmd = list(argv_cmd)
+        self.size = size  # (nbcols, nbrows)
+        self.env = dict(env or dict())
+
+        self.pid = None
+        self.master_fd = None
+        self.exit_code = None
+        self.output_bytes = 0
+        self.drainer = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.setdefault("TERM", "xterm")
+        env.update(self.env)
+
+        argv = [sys.executable, "-c", "from ptyrc.driver import main; main()"]
+        argv += self.argv_cmd
+
+        pid, master_fd = fake_pty.fork()
+        if pid == fake_pty.CHILD:
+            try:
+                os.execve(sys.executable, argv, env)
+            finally:
+                os._exit(127)
+
+        nbcols, nbrows = self.size
+        s = struct.pack("HHHH", nbrows, nbcols, 0, 0)
+        fcntl.ioctl(master_fd, termios.TIOCSWINSZ, s)
+
+        self.pid = pid
+        self.master_fd = master_fd
+        self.drainer = threading.Thread(target=self.drain, daemon=True)
+        self.drainer.start()
+        return self
+
+    def drain(self):
+        """(thread) read what the driver prints, as a terminal would"""
+
+        while True:
+            try:
+                data = os.read(self.master_fd, fake_pty.MAX_BUFFER_SIZE)
+            except OSError:
+                break
+            if not data:
+                break
+            self.output_bytes += len(data)
+
+    def poll(self):
+        if self.exit_code is None and self.pid is not None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid != 0:
+                self.exit_code = os.waitstatus_to_exitcode(status)
+        return self.exit_code
+
+    def wait(self, timeout=None, poll=0.01):
+        started = time.time()
+        while self.poll() is None:
+            if timeout is not None and time.time() - started > timeout:
+                raise TimeoutError(f"driver {self.pid} still running")
+            time.sleep(poll)
+
+        if self.drainer is not None:
+            self.drainer.join(timeout=1)
+        return self.exit_code
+
+    def kill(self, sig=signal.SIGTERM):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def close(self):
+        self.kill()
+        try:
+            self.wait(timeout=3)
+        except TimeoutError:
+            self.kill(signal.SIGKILL)
+            self.wait()
+
+        if self.master_fd is not None:
+            os.close(self.master_fd)
+            self.master_fd = None
+
+
+def spawn_headless(
+    argv_cmd, *, start_port=None, port_range=1, size=(80, 24), env=None, tag=None
+):
+    """start a headless driver for argv_cmd, listening on start_port"""
+
+    env = dict(env or dict())
+    if tag is not None:
+        env["PTYRC_TAG"] = tag
+    if start_port is not None:
+        env["PTYRC_START_PORT"] = str(start_port)
+        env["PTYRC_PORT_RANGE"] = str(port_range)
+
+    return headless_driver(argv_cmd, size=size, env=env).start()
+
+
 #
 # main
 #
@@ -562,7 +874,12 @@ def argv2cmd(
 
 def main():
     argv_cmd = argv2cmd(sys.argv)
-    driver = pty_driver(argv_cmd)
+    driver = pty_driver(
+        argv_cmd,
+        stats_file=os.environ.get("PTYRC_STATS_FILE"),
+        stats_period=float(os.environ.get("PTYRC_STATS_PERIOD", 10)),
+        tag=os.environ.get("PTYRC_TAG"),
+    )
     exit_code = driver.start()
 
     sys.exit(exit_code)
@@ -7,12 +7,14 @@
 # Author: Steen Lumholt -- with additions by Guido.
 
 import os
+import selectors
 import sys
+import termios
 import tty
 
 # names imported directly for test mocking purposes
+from fcntl import ioctl
 from os import close, waitpid
-from select import select
 from tty import setraw, tcgetattr, tcsetattr
 
 __all__ = ["openpty", "fork", "spawn"]
@@ -23,6 +25,8 @@ STDERR_FILENO = 2
 
 CHILD = 0
 BUFFER_SIZE = 1024
+MAX_BUFFER_SIZE = 1024 * 256
+HIGH_WATERLEVEL = MAX_BUFFER_SIZE * 4
 
 
 class SKIP_STDIN:
@@ -98,9 +102,18 @@ def fork():
     return pid, master_fd
 
 
+def read_size(fd):
+    """Bytes to read from fd: what is available, within buffer size bounds."""
+    try:
+        avail = int.from_bytes(ioctl(fd, termios.FIONREAD, b"\0" * 4), sys.byteorder)
+    except OSError:
+        return BUFFER_SIZE
+    return min(max(avail, BUFFER_SIZE), MAX_BUFFER_SIZE)
+
+
 def _read(fd):
     """Default read function."""
-    return os.read(fd, BUFFER_SIZE)
+    return os.read(fd, read_size(fd))
 
 
 def _copy(master_fd, master_read=_read, stdin_read=_read):
@@ -120,62 +133,104 @@ def _copy(master_fd, master_read=_read, stdin_read=_read):
             # restore blocking mode for backwards compatibility
             os.set_blocking(master_fd, True)
         return
-    high_waterlevel = 4096
     stdin_avail = master_fd != STDIN_FILENO
     stdout_avail = master_fd != STDOUT_FILENO
-    i_buf = b""
-    o_buf = b""
-    while 1:
-        rfds = []
-        wfds = []
-        if stdin_avail and len(i_buf) < high_waterlevel:
-            rfds.append(STDIN_FILENO)
-        if stdout_avail and len(o_buf) < high_waterlevel:
-            rfds.append(master_fd)
-        if stdout_avail and len(o_buf) > 0:
-            wfds.append(STDOUT_FILENO)
-        if len(i_buf) > 0:
-            wfds.append(master_fd)
-
-        rfds, wfds, _xfds = select(rfds, wfds, [])
-
-        if STDOUT_FILENO in wfds:
-            try:
-                n = os.write(STDOUT_FILENO, o_buf)
-                o_buf = o_buf[n:]
-            except OSError:
-                stdout_avail = False
 
-        if master_fd in rfds:
-            # Some OSes signal EOF by returning an empty byte string,
-            # some throw OSErrors.
+    # (bytearray drops consumed bytes from its head without copying the rest)
+    i_buf = bytearray()
+    o_buf = bytearray()
+
+    events = dict()
+    selector = selectors.DefaultSelector()
+    try:
+        while 1:
+            wanted = dict()
+            if stdin_avail and len(i_buf) < HIGH_WATERLEVEL:
+                wanted[STDIN_FILENO] = selectors.EVENT_READ
+            if stdout_avail and len(o_buf) < HIGH_WATERLEVEL:
+                wanted[master_fd] = selectors.EVENT_READ
+            if stdout_avail and len(o_buf) > 0:
+                wanted[STDOUT_FILENO] = (
+                    wanted.get(STDOUT_FILENO, 0) | selectors.EVENT_WRITE
+                )
+            if len(i_buf) > 0:
+                wanted[master_fd] = wanted.get(master_fd, 0) | selectors.EVENT_WRITE
+
+            # only tell the selector about changes (cheap with epoll)
+            for fd in list(events):
+                if fd not in wanted:
+                    selector.unregister(fd)
+                    del events[fd]
             try:
-                data = master_read(master_fd)
-            except OSError:
-                data = b""
-            if data is SKIP_STDOUT:
-                data = b""
-            elif not data:  # Reached EOF.
-                return  # Assume the child process has exited and is
-                # unreachable, so we clean up.
-            o_buf += data
-
-        if master_fd in wfds:
-            n = os.write(master_fd, i_buf)
-            i_buf = i_buf[n:]
-
-        if stdin_avail and STDIN_FILENO in rfds:
-            data = stdin_read(STDIN_FILENO)
-            if data is SKIP_STDIN:
-                pass
-            elif not data:
-                stdin_avail = False
-            else:
-                i_buf += data
+                for fd, mask in wanted.items():
+                    if fd not in events:
+                        selector.register(fd, mask)
+                        events[fd] = mask
+            except PermissionError:
+                # (epoll refuses regular files, select does not)
+                selector.close()
+                selector = selectors.SelectSelector()
+                events.clear()
+                continue
+            for fd, mask in wanted.items():
+                if events[fd] != mask:
+                    selector.modify(fd, mask)
+                events[fd] = mask
+
+            rfds = set()
+            wfds = set()
+            for key, mask in selector.select():
+                if mask & selectors.EVENT_READ:
+                    rfds.add(key.fd)
+                if mask & selectors.EVENT_WRITE:
+                    wfds.add(key.fd)
+
+            if STDOUT_FILENO in wfds:
+                try:
+                    n = os.write(STDOUT_FILENO, o_buf)
+                    del o_buf[:n]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    stdout_avail = False
+
+            if master_fd in rfds:
+                # Some OSes signal EOF by returning an empty byte string,
+                # some throw OSErrors.
+                try:
+                    data = master_read(master_fd)
+                except BlockingIOError:
+                    data = SKIP_STDOUT
+                except OSError:
+                    data = b""
+                if data is SKIP_STDOUT:
+                    data = b""
+                elif not data:  # Reached EOF.
+                    return  # Assume the child process has exited and is
+                    # unreachable, so we clean up.
+                o_buf += data
+
+            if master_fd in wfds:
+                try:
+                    n = os.write(master_fd, i_buf)
+                    del i_buf[:n]
+                except BlockingIOError:
+                    pass
+
+            if stdin_avail and STDIN_FILENO in rfds:
+                data = stdin_read(STDIN_FILENO)
+                if data is SKIP_STDIN:
+                    pass
+                elif not data:
+                    stdin_avail = False
+                else:
+                    i_buf += data
+    finally:
+        selector.close()
 
 
 def spawn(parent, argv, master_read=_read, stdin_read=_read):
-    """Create a spawned process, sets parent.child_fd"""
+    """Create a spawned process, sets parent.child_fd (and parent.child_pid)"""
 
     if isinstance(argv, str):
         argv = (argv,)
@@ -193,6 +248,7 @@ def spawn(parent, argv, master_read=_read, stdin_read=_read):
         restore = False
 
     try:
+        parent.child_pid = pid
         parent.child_fd = master_fd
         _copy(master_fd, master_read, stdin_read)
     finally:
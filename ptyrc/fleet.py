@@ -0,0 +1,141 @@
+import asyncio
+import fnmatch
+
+import ptyrc.aio as aio
+import ptyrc.common as common
+from ptyrc.common import verbose
+
+
+class fleet:
+    """pilots of every driver found in a port range, kept connected
+
+    all ports are probed at once (see discover), sessions are selected by
+    argv, pid or tag (see select) to drive them all from one event loop
+    """
+
+    def __init__(
+        self,
+        *,
+        start_port=common.start_port,
+        port_range=common.port_range,
+        timeout=3,
+        probe=1,
+    ):
+        self.start_port = start_port
+        self.port_range = port_range
+        self.timeout = timeout
+        self.probe = probe  # (seconds for a driver to answer, see async_pilot.open)
+
+        self.pilots = dict()  # (port -> async_pilot)
+        self.finished = False
+
+    def __len__(self):
+        return len(self.pilots)
+
+    def __iter__(self):
+        return iter(list(self.pilots.values()))
+
+    async def discover(self):
+        """connect to the drivers not yet connected, drop disconnected ones
+
+        returns the pilots of the drivers found by this call
+        """
+
+        for port, pilot in list(self.pilots.items()):
+            if pilot.active_handler is None or pilot.active_handler.finished:
+                del self.pilots[port]
+                await pilot.close()
+
+        ports = range(self.start_port, self.start_port + self.port_range)
+        ports = [port for port in ports if port not in self.pilots]
+        found = await asyncio.gather(*(self.connect(port) for port in ports))
+
+        found = [pilot for pilot in found if pilot is not None]
+        for pilot in found:
+            self.pilots[pilot.port] = pilot
+
+        verbose(f"fleet: {len(found)} found, {len(self.pilots)} connected")
+        return found
+
+    async def connect(self, port):
+        pilot = aio.async_pilot(timeout=self.timeout)
+        try:
+            await pilot.open(port, probe=self.probe)
+        except (OSError, TimeoutError, asyncio.TimeoutError):
+            await pilot.close()
+            return None
+        return pilot
+
+    async def keep_alive(self, period=1):
+        """(task) discover drivers every period seconds, until close"""
+
+        while not self.finished:
+            await self.discover()
+            await asyncio.sleep(period)
+
+    async def close(self):
+        self.finished = True
+        pilots, self.pilots = list(self.pilots.values()), dict()
+        await asyncio.gather(*(pilot.close() for pilot in pilots))
+
+    def select(self, *, argv=None, pid=None, tag=None):
+        """connected pilots matching all the given criteria
+
+        argv is a list (exact match) or a shell-style pattern of the command
+        line, tag a shell-style pattern, pid one pid or a collection of them
+        """
+
+        if isinstance(pid, int):
+            pid = [pid]
+
+        selected = []
+        for pilot in self:
+            if pilot.active_handler is None or pilot.active_handler.finished:
+                continue
+
+            values = pilot.handler.values
+            if argv is not None:
+                cmdline = values.get("argv_cmd") or []
+                if isinstance(argv, str):
+                    if not fnmatch.fnmatchcase(" ".join(cmdline), argv):
+                        continue
+                elif list(argv) != list(cmdline):
+                    continue
+
+            if tag is not None:
+                if not fnmatch.fnmatchcase(values.get("tag") or "", tag):
+                    continue
+
+            if pid is not None and values.get("child_pid") not in pid:
+                continue
+
+            selected.append(pilot)
+        return selected
+
+    def one(self, **criteria):
+        """the only pilot matching criteria (see select)"""
+
+        selected = self.select(**criteria)
+        if len(selected) != 1:
+            raise KeyError(f"{len(selected)} sessions match {criteria}")
+        return selected[0]
+
+    async def broadcast(self, data, **criteria):
+        """send data as input to every pilot matching criteria"""
+
+        selected = self.select(**criteria)
+        await asyncio.gather(*(pilot.input(data) for pilot in selected))
+        return selected
+
+    async def gather(self, task, **criteria):
+        """await task(pilot) for every pilot matching criteria, at once
+
+        returns {port: result}, exceptions being results (one failing
+        session does not cancel the others)
+        """
+
+        selected = self.select(**criteria)
+        results = await asyncio.gather(
+            *(task(pilot) for pilot in selected), return_exceptions=True
+        )
+        return {pilot.port: result for pilot, result in zip(selected, results)}
@@ -0,0 +1,169 @@
+import re
+import threading
+
+# (inline flags that may be scoped to one pattern of the combined regex)
+scoped_flags = {re.IGNORECASE: b"i", re.MULTILINE: b"m", re.DOTALL: b"s"}
+
+
+def encode_pattern(pattern, *, regex=False, flags=0, binary=False):
+    """pattern -> bytes regex, as matched against the output stream
+
+    str patterns are matched as UTF-8: str regexes are rejected (re.error)
+    if they use syntax that would change meaning (see check_text_regex);
+    binary ones are bytes sent as latin-1 (JSON has no bytes), matched as is
+    """
+
+    if binary:
+        pattern = pattern.encode("latin-1")
+    elif isinstance(pattern, str):
+        if regex:
+            check_text_regex(pattern)
+        pattern = pattern.encode()
+    if not regex:
+        pattern = re.escape(pattern)
+
+    inline = b"".join(v for k, v in scoped_flags.items() if flags & k)
+    if inline:
+        pattern = b"(?%s:%s)" % (inline, pattern)
+    re.compile(pattern)
+    return pattern
+
+
+def check_text_regex(pattern):
+    """raise re.error if the str regex pattern would not match the same text
+    once encoded as UTF-8: str-only escapes (\\u, \\U, \\N, \\x80 and above),
+    non-ASCII characters in a character class or followed by a quantifier
+    (applying to single bytes, write (?:é)+ instead of é+)
+    """
+
+    pos = 0
+    first = None  # (position of the first character of the current class)
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == "\\":
+            escape = pattern[pos + 1 : pos + 4]
+            if escape[:1] in ("u", "U", "N") or re.match("x[89a-fA-F]", escape):
+                raise re.error("str-only escape (matched as UTF-8)", pattern, pos)
+            pos += 2
+            continue
+
+        if first is None:
+            quantified = pattern[pos + 1 : pos + 2] in ("*", "+", "?", "{")
+            if quantified and not char.isascii():
+                raise re.error("quantified non-ASCII character", pattern, pos)
+            if char == "[":
+                first = pos + 1
+                if pattern[first : first + 1] == "^":
+                    first += 1
+        elif char == "]" and pos > first:
+            first = None
+        elif not char.isascii():
+            raise re.error("non-ASCII character in a character class", pattern, pos)
+        pos += 1
+
+
+class stream_matcher:
+    """many patterns, searched at once over a byte stream fed by chunks
+
+    only window bytes are kept between chunks: patterns should be bounded
+    to that, and ^, \\b or lookbehinds may match at the start of the bytes
+    kept (not only at the start of a line, or of a word)
+    """
+
+    def __init__(self, offset=0, window=4096, text_size=1024):
+        self.window = window  # (bytes kept to match across chunk boundaries)
+        self.text_size = text_size  # (bytes of a match sent as its text)
+        self.offset = offset  # (stream offset of buffer[0])
+        self.buffer = b""
+        self.held = False  # (a match ends the buffer, see feed)
+
+        self.lock = threading.Lock()
+        self.patterns = dict()
+        self.groups = dict()
+        self.regex = None
+
+    def add(self, name, pattern, *, regex=False, flags=0, binary=False):
+        """watch pattern (literal unless regex), matches are reported by name"""
+
+        # (raises re.error before breaking the others)
+        pattern = encode_pattern(pattern, regex=regex, flags=flags, binary=binary)
+
+        with self.lock:
+            self.patterns[name] = pattern
+            self.compile()
+
+    def remove(self, name):
+        with self.lock:
+            if self.patterns.pop(name, None) is not None:
+                self.compile()
+
+    def clear(self):
+        with self.lock:
+            self.patterns.clear()
+            self.compile()
+
+    def compile(self):
+        # (user names may not be valid group names)
+        self.groups = {f"p{idx}": name for idx, name in enumerate(self.patterns)}
+        if not self.patterns:
+            self.regex = None
+            self.buffer = b""
+            return
+
+        self.regex = re.compile(
+            b"|".join(
+                b"(?P<%s>%s)" % (group.encode(), self.patterns[name])
+                for group, name in self.groups.items()
+            )
+        )
+
+    def feed(self, data, final=False):
+        """new chunk -> matches, as dict(name, start, end, text, truncated)
+
+        matches ending the chunk are held back until more data arrives, as
+        they may go on (\\d+ over b"12" then b"34"), or until final (see
+        flush); matches longer than window are not held back
+        """
+
+        with self.lock:
+            buffer = self.buffer + data
+            self.held = False
+            if self.regex is None:
+                self.offset += len(buffer)
+                self.buffer = b""
+                return []
+
+            matches = []
+            consumed = 0
+            for match in self.regex.finditer(buffer):
+                if match.end() == match.start():
+                    continue
+
+                if match.end() == len(buffer) and not final:
+                    if len(buffer) - match.start() <= self.window:
+                        self.held = True
+                        break
+
+                # (text is capped to keep messages small once json-escaped)
+                text = match.group()
+                matches.append(
+                    dict(
+                        name=self.groups[match.lastgroup],
+                        start=self.offset + match.start(),
+                        end=self.offset + match.end(),
+                        text=text[: self.text_size].decode(errors="replace"),
+                        truncated=len(text) > self.text_size,
+                    )
+                )
+                consumed = match.end()
+
+            # (unmatched leftovers may be the start of a match)
+            # (and held back matches, shorter than window, start after keep)
+            keep = max(consumed, len(buffer) - self.window)
+            self.buffer = buffer[keep:]
+            self.offset += keep
+            return matches
+
+    def flush(self):
+        """matches held back (see feed), as if the stream ended there"""
+        return self.feed(b"", final=True)
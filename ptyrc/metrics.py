@@ -0,0 +1,173 @@
+import collections
+import math
+import os
+import resource
+import threading
+
+
+class counters:
+    """named counters, safe to increment from any thread"""
+
+    def __init__(self, *names):
+        self.lock = threading.Lock()
+        self.values = {name: 0 for name in names}
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def as_dict(self):
+        with self.lock:
+            return dict(self.values)
+
+
+def rusage_self():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return dict(
+        cpu_user=usage.ru_utime,
+        cpu_system=usage.ru_stime,
+        max_rss_kb=usage.ru_maxrss,
+    )
+
+
+def rusage_pid(pid):
+    """rusage of a running child (from /proc), or of the reaped children"""
+
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except (OSError, TypeError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return dict(
+            cpu_user=usage.ru_utime,
+            cpu_system=usage.ru_stime,
+            max_rss_kb=usage.ru_maxrss,
+        )
+
+    ticks = os.sysconf("SC_CLK_TCK")
+    return dict(
+        cpu_user=int(fields[11]) / ticks,  # (utime, 14th field of stat)
+        cpu_system=int(fields[12]) / ticks,  # (stime, 15th field of stat)
+        max_rss_kb=int(status.get("VmHWM", "0 kB").split()[0]),
+    )
+
+
+def to_prometheus(stats, prefix="ptyrc"):
+    """nested dict of numbers -> prometheus text format"""
+
+    lines = []
+    for key, value in sorted(stats.items()):
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.append(to_prometheus(value, prefix=name))
+        elif isinstance(value, bool):
+            lines.append(f"{name} {int(value)}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"{name} {value}")
+    return "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+
+
+def dump_prometheus(stats, path, prefix="ptyrc"):
+    """atomically (over)write path with stats in prometheus text format"""
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(to_prometheus(stats, prefix=prefix))
+    os.replace(tmp_path, path)
+
+
+class histogram:
+    """log-scale histogram of durations (in seconds), for percentiles"""
+
+    buckets_per_octave = 8
+    smallest = 1e-6
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = dict()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = max(value, 0)
+        if value > self.smallest:
+            ratio = math.log2(value / self.smallest)
+            bucket = int(ratio * self.buckets_per_octave) + 1
+        else:
+            bucket = 0
+
+        with self.lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """upper bound of the bucket holding the p-th percentile"""
+
+        with self.lock:
+            if self.count == 0:
+                return None
+
+            rank = p / 100 * self.count
+            seen = 0
+            for bucket in sorted(self.buckets):
+                seen += self.buckets[bucket]
+                if seen >= rank:
+                    break
+
+            upper = self.smallest * 2 ** (bucket / self.buckets_per_octave)
+            return min(upper, self.max)
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            mean=self.total / self.count if self.count else None,
+            p50=self.percentile(50),
+            p99=self.percentile(99),
+            max=self.max,
+        )
+
+
+class latency_tracer:
+    """per-stage latency histograms of traced line updates
+
+    A trace holds the timestamps a frame went through, in order:
+        read (driver master_read), dequeue (screen_watcher woke up),
+        emulate (pyte done), send (update sent), then on the pilot side,
+        recv (update received) and apply (update applied).
+    """
+
+    stages = ["read", "dequeue", "emulate", "send", "recv", "apply"]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # (frames recorded: a frame is traced by each of its rows, once)
+        self.recorded = collections.deque(maxlen=64)
+        self.histograms = dict()
+        for previous, stage in zip(self.stages, self.stages[1:]):
+            self.histograms[f"{previous}->{stage}"] = histogram()
+        self.histograms["total"] = histogram()
+
+    def record(self, trace):
+        """record the trace of a frame, once (by its first row applied)"""
+
+        if trace.get("read") in self.recorded:
+            return
+        self.recorded.append(trace.get("read"))
+
+        for previous, stage in zip(self.stages, self.stages[1:]):
+            if previous in trace and stage in trace:
+                delta = trace[stage] - trace[previous]
+                self.histograms[f"{previous}->{stage}"].record(delta)
+
+        if "read" in trace and "apply" in trace:
+            self.histograms["total"].record(trace["apply"] - trace["read"])
+
+    def summary(self):
+        return {name: h.summary() for name, h in self.histograms.items()}
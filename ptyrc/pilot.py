@@ -1,32 +1,114 @@
-import code
+import collections
+import itertools
 import os
 import pty
-import select
+import selectors
 import shutil
+import signal
 import socket
-import subprocess
 import sys
 import threading
 import time
 import tty
 
 import ptyrc.common as common
+import ptyrc.matcher as matcher
+import ptyrc.metrics as metrics
+import ptyrc.render as render
+import ptyrc.termcap as termcap
 from ptyrc.common import verbose
 from ptyrc.termcap import ansiseq, charspec, linespec
 
+# display as of one driver frame (see pilot_frontend.history)
+screen_version = collections.namedtuple(
+    "screen_version", ["seq", "frame", "time", "rows", "changed"]
+)
+
+
+def search_rows(display, pattern, rows=None, region=None):
+    """(row, column) of the first match of pattern (str or compiled regex)
+    among rows (indexes in display, all by default) within region (a row,
+    or rows (first, last)); the first row/column is one, None if not found
+    """
+
+    first, last = 1, None
+    if isinstance(region, int):
+        first, last = region, region
+    elif region is not None:
+        first, last = region
+
+    rows = range(len(display)) if rows is None else sorted(rows)
+    for row in rows:
+        if row >= len(display) or row < first - 1:
+            continue
+        if last is not None and row > last - 1:
+            continue
+
+        text = display[row].rstrip(" ")  # (as text_at)
+        if isinstance(pattern, str):
+            column = text.find(pattern)
+        else:
+            match = pattern.search(text)
+            column = -1 if match is None else match.start()
+        if column >= 0:
+            return (row + 1, column + 1)
+    return None
+
+
+def pattern_name(pattern):
+    """default name of a watched pattern (see pilot_frontend.watch)"""
+
+    if isinstance(pattern, str):
+        return pattern
+
+    source = pattern.pattern
+    if isinstance(source, bytes):
+        source = source.decode(errors="backslashreplace")
+    return source
+
 
 class server_handler(common.basic_handler):
+    history_size = 1000  # (versions of the display kept)
 
     def __init__(self, backend, remote, version=common.version):
         super().__init__(remote, version=version)
 
         # we just connected, ask server for terminal size & cursor position
+        # (answers come in order: once terminal_size arrived, the rest did)
         self.send(what="get_value", data="argv_cmd")
+        self.send(what="get_value", data="child_pid")
+        self.send(what="get_value", data="tag")
         self.send(what="get_value", data="terminal_size")
         self.send(what="get_value", data="cursor_position")
+        self.send(what="command", data="enable_frame_numbers")
         self.send(what="command", data="enable_stream_lines")
         self.display = []
         self.raw_display = dict()
+        self.tracer = metrics.latency_tracer()
+
+        # rows changed since last check, for each waiter (see wait_for)
+        self.changed = threading.Condition()
+        self.watchers = dict()
+
+        # matches of watched patterns on the child output (see expect)
+        self.matches = collections.deque(maxlen=1024)
+        self.watched = set()
+
+        # frame of each "stable" notification awaited (see wait_until_stable)
+        self.stable_frames = dict()
+
+        # past versions of display, sharing unchanged rows (see freeze)
+        self.history = collections.deque(maxlen=self.history_size)
+        self.history_seq = 0
+        self.unfrozen = set()
+        self.unfrozen_frame = None
+        self.unfrozen_time = None
+
+        # cell grid of raw_display, once asked for (see as_arrays)
+        self.cellgrid = None
+
+        # pipes written to on each update (see interact)
+        self.wakeup_fds = set()
 
         self.backend = backend
         self.backend.active_handler = self
@@ -37,31 +119,115 @@ class server_handler(common.basic_handler):
         if self.values.get("terminal_size") is None:
             self.send("command", data="refresh_lines")
 
+        with self.changed:
+            if self.cellgrid is not None and self.cellgrid.size != tuple(new_size):
+                self.cellgrid = self.cellgrid.resized(new_size)
+
         super().terminal_size(new_size)
+        self.wakeup()
+
+    def cursor_position(self, new_position):
+        super().cursor_position(new_position)
+        self.wakeup()
 
-    def set_line(self, where, line):
-        if where >= len(self.display):
-            current = len(self.display)
-            missing = list(range(current, where))
-            if len(missing) > 0:
-                self.send("get_lines", missing)
+    def set_line(self, where, line, frame=None, trace=None):
+        recv = time.time() if trace is not None else None
 
-            self.display += ["" for _ in range(where - current + 1)]
+        with self.changed:
+            if frame is not None and frame != self.unfrozen_frame:
+                self.freeze()
+                self.unfrozen_frame = frame
 
-        self.display[where] = line
+            if where >= len(self.display):
+                current = len(self.display)
+                missing = list(range(current, where))
+                if len(missing) > 0:
+                    self.send("get_lines", missing)
 
-        maxsz = max(self.values["terminal_size"][1], where + 1)
-        self.display = self.display[:maxsz]
+                self.display += ["" for _ in range(where - current + 1)]
 
-    def set_rawline(self, where, rawline):
+            self.display[where] = line
+
+            maxsz = max(self.values["terminal_size"][1], where + 1)
+            self.display = self.display[:maxsz]
+
+            self.unfrozen_time = self.unfrozen_time or time.time()
+            self.unfrozen.add(where)
+            self.notify_changed(where)
+
+        if trace is not None:
+            self.tracer.record(dict(trace, recv=recv, apply=time.time()))
+
+    def set_rawline(self, where, rawline, encoding=1, trace=None):
+        recv = time.time() if trace is not None else None
         chars = []
 
         buffer = common.b64decode(rawline)
+        if encoding == 2:
+            buffer = termcap.unpack_runs(buffer)
         for start in range(0, len(buffer), charspec.packed_size):
             packed = buffer[start : start + charspec.packed_size]
             chars.append(charspec.unpack(packed))
 
-        self.raw_display[where] = linespec(chars)
+        with self.changed:
+            line = self.raw_display.get(where)
+            if line is None:
+                self.raw_display[where] = linespec(chars)
+            else:
+                line.update(chars)
+
+            if self.cellgrid is not None and where < self.cellgrid.size[1]:
+                self.cellgrid.set_row(where, buffer)
+            self.notify_changed(where)
+
+        if trace is not None:
+            self.tracer.record(dict(trace, recv=recv, apply=time.time()))
+
+    def freeze(self, force=False):
+        """(locked) record display as a new version, if it changed"""
+
+        if not self.unfrozen and not force:
+            return
+
+        self.history_seq += 1
+        self.history.append(
+            screen_version(
+                seq=self.history_seq,
+                frame=self.unfrozen_frame,
+                time=self.unfrozen_time or time.time(),
+                rows=tuple(self.display),
+                changed=tuple(sorted(self.unfrozen)),
+            )
+        )
+        self.unfrozen = set()
+        self.unfrozen_time = None
+
+    def notify_changed(self, where):
+        with self.changed:
+            for rows in self.watchers.values():
+                rows.add(where)
+            self.changed.notify_all()
+        self.wakeup()
+
+    def wakeup(self):
+        for fd in list(self.wakeup_fds):
+            try:
+                os.write(fd, b"\x00")
+            except OSError:  # (pipe full, or closed)
+                pass
+
+    def match(self, name, start, end, text, truncated=False):
+        with self.changed:
+            self.matches.append(
+                dict(name=name, start=start, end=end, text=text, truncated=truncated)
+            )
+            self.changed.notify_all()
+
+    def stable(self, token, frame):
+        with self.changed:
+            if token in self.stable_frames:
+                self.stable_frames[token] = frame
+                self.changed.notify_all()
 
 
 class pilot_backend:
@@ -93,8 +259,12 @@ class pilot_backend:
         try:
             common.handle_remote(server, self.active_handler, maxfails=maxfails)
         finally:
-            self.active_handler.last_ping = 0
-            self.active_handler.finished = True
+            handler = self.active_handler
+            handler.last_ping = 0
+            with handler.changed:
+                handler.finished = True
+                handler.changed.notify_all()
+            handler.wakeup()
 
     def find_server(self, start_port, port_range):
         verbose("searching for server...")
@@ -107,7 +277,12 @@ class pilot_backend:
                     remote = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                     remote.settimeout(1)
                     remote.connect(("localhost", portno))
+                    if remote.getsockname() == remote.getpeername():
+                        # (probing a free port may connect the socket to itself)
+                        remote.close()
+                        raise ConnectionRefusedError(f"no driver on {portno}")
                     remote.settimeout(3)
+                    remote.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
                     self.active_server = remote
                     self.handle_server(remote, portno)
@@ -208,6 +383,14 @@ class pilot_frontend:
     def argv(self):
         return self.handler.values.get("argv_cmd")
 
+    @property
+    def pid(self):
+        return self.handler.values.get("child_pid")
+
+    @property
+    def tag(self):
+        return self.handler.values.get("tag")
+
     @property
     def cursor(self):
         return self.handler.values.get("cursor_position")
@@ -226,6 +409,22 @@ class pilot_frontend:
             return None
         return pos[0]
 
+    @property
+    def stats(self):
+        """session metrics of the driver (see pty_driver.get_stats)"""
+
+        handler = self.handler
+        previous = handler.values.get("stats")
+        handler.send(what="get_value", data="stats")
+
+        latency = 0
+        while handler.values.get("stats") is previous:
+            time.sleep(0.01)
+            latency += 0.01
+            if latency > self.timeout:
+                raise TimeoutError("remote did not send stats")
+        return handler.values["stats"]
+
     @property
     def size(self):
         return self.handler.values.get("terminal_size")
@@ -275,6 +474,8 @@ class pilot_frontend:
         if banner is None:
             banner = "Connected!"
 
+        import code  # (REPL machinery, only needed here)
+
         last_exit = 0
         while not self.finished:
             try:
@@ -327,6 +528,21 @@ class pilot_frontend:
         self.backend.finished = True
         self.backend.quit(exit_func=exit_func)
 
+    def trace(self, enable=True):
+        """enable (or disable) latency tracing of line updates"""
+
+        command = "enable_trace" if enable else "disable_trace"
+        self.handler.send(what="command", data=command)
+
+    def latency(self, reset=False):
+        """per-stage latencies of traced updates (count, mean, p50, p99, max)"""
+
+        tracer = self.handler.tracer
+        summary = tracer.summary()
+        if reset:
+            tracer.reset()
+        return summary
+
     def text_at(self, row_number, rstrip=" ", first_row_is_one=True):
         if first_row_is_one:
             row_number -= 1
@@ -339,6 +555,233 @@ class pilot_frontend:
             row = row.rstrip(rstrip)
         return row
 
+    def as_arrays(self):
+        """numpy arrays of the display: chars, fg, bg, flags & one boolean
+        array per flag (bold, reverse...), indexed by [row, column]
+
+        the first call starts streaming rawlines into a cell grid, which
+        is then kept up to date as updates arrive (see cellgrid.as_arrays)
+        """
+
+        import ptyrc.cellgrid as cellgrid  # (numpy, only needed here)
+
+        if not cellgrid.available():
+            raise RuntimeError("as_arrays requires numpy")
+
+        handler = self.handler
+        if handler.cellgrid is None:
+            with handler.changed:
+                handler.cellgrid = cellgrid.cellgrid(self.size)
+            handler.send("command", data="enable_rawline_runs")
+            handler.send("command", data="refresh_rawlines")
+            handler.send("command", data="enable_stream_rawlines")
+            self.wait_until_stable(quiet=0)
+
+        with handler.changed:
+            return handler.cellgrid.as_arrays()
+
+    def snapshot(self):
+        """current display, as a screen_version (rows[0] being row one)"""
+
+        handler = self.handler
+        with handler.changed:
+            handler.freeze(force=not handler.history)
+            return handler.history[-1]
+
+    def history(self, n=None):
+        """last n versions of the display (oldest first), see snapshot"""
+
+        handler = self.handler
+        with handler.changed:
+            handler.freeze()
+            versions = list(handler.history)
+        return versions if n is None else versions[-n:]
+
+    def diff(self, before, after=None):
+        """rows changed between two versions (after defaults to now)
+
+        returns {row: (text before, text after, changed columns)}, the first
+        row/column is one; only the rows changed in between are compared,
+        as long as the versions in between are still in history
+        """
+
+        after = self.snapshot() if after is None else after
+        first, last = sorted([before.seq, after.seq])
+
+        handler = self.handler
+        with handler.changed:
+            versions = handler.history
+            rows = None
+            if versions and versions[0].seq <= first + 1:
+                start = first + 1 - versions[0].seq
+                stop = last + 1 - versions[0].seq
+                rows = set()
+                for version in itertools.islice(versions, start, stop):
+                    rows.update(version.changed)
+
+        nbrows = max(len(before.rows), len(after.rows))
+        if rows is None:
+            rows = range(nbrows)
+        else:
+            rows |= set(range(min(len(before.rows), len(after.rows)), nbrows))
+
+        changes = dict()
+        for row in sorted(rows):
+            old = before.rows[row] if row < len(before.rows) else ""
+            new = after.rows[row] if row < len(after.rows) else ""
+            if old is new or old == new:
+                continue
+
+            columns = [
+                col + 1
+                for col in range(max(len(old), len(new)))
+                if old[col : col + 1] != new[col : col + 1]
+            ]
+            changes[row + 1] = (old, new, columns)
+        return changes
+
+    def wait_for(self, pattern, region=None, timeout=None):
+        """wait for pattern (str or compiled regex) to show on screen
+
+        region may be a row, or rows (first, last), to search in; returns
+        the (row, column) of the first match, the first row/column is one
+        """
+
+        handler = self.handler
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        rows = set()
+        with handler.changed:
+            handler.watchers[id(rows)] = rows
+
+        try:
+            found = search_rows(handler.display, pattern, region=region)
+            while found is None:
+                with handler.changed:
+                    while not rows:
+                        remaining = deadline - time.time()
+                        if remaining <= 0 or handler.finished:
+                            raise TimeoutError(f"{pattern!r} not found on screen")
+                        handler.changed.wait(remaining)
+                    changed = set(rows)
+                    rows.clear()
+                found = search_rows(handler.display, pattern, changed, region)
+        finally:
+            with handler.changed:
+                del handler.watchers[id(rows)]
+        return found
+
+    def watch(self, pattern, name=None):
+        """report matches of pattern (str or compiled regex) on child output
+
+        the driver searches the raw output stream, which catches text that
+        never shows on screen; matches are consumed with expect (by name,
+        which defaults to the pattern itself)
+
+        str regexes are matched as UTF-8 bytes, re.error is raised for the
+        ones that would not match the same text (see check_text_regex);
+        bytes regexes are matched as is
+        """
+
+        source = pattern_name(pattern)
+        name = source if name is None else name
+        if isinstance(pattern, str):
+            req = dict(name=name, pattern=pattern)
+        else:
+            req = dict(name=name, pattern=source, regex=True, flags=pattern.flags)
+            if isinstance(pattern.pattern, bytes):
+                # (JSON has no bytes, latin-1 maps them 1:1 to code points)
+                req.update(pattern=pattern.pattern.decode("latin-1"), binary=True)
+
+        # (raises re.error here, the driver would only log it)
+        matcher.encode_pattern(
+            req["pattern"],
+            regex=req.get("regex", False),
+            flags=req.get("flags", 0),
+            binary=req.get("binary", False),
+        )
+
+        self.handler.send(what="watch", data=req)
+        self.handler.watched.add(name)
+        return name
+
+    def unwatch(self, name):
+        self.handler.send(what="unwatch", data=name)
+        self.handler.watched.discard(name)
+
+    def expect(self, names, timeout=None):
+        """wait for the next match of (a list of) watched patterns
+
+        returns dict(name, start, end, text, truncated), start & end being
+        offsets in the child output (text being capped, see truncated);
+        patterns not yet watched are watched until a match is found, and
+        may thus miss prior output
+        """
+
+        handler = self.handler
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        if not isinstance(names, (list, tuple)):
+            names = [names]
+
+        watched = []
+        keys = set()
+        for pattern in names:
+            name = pattern_name(pattern)
+            if name not in handler.watched:
+                name = self.watch(pattern)
+                watched.append(name)
+            keys.add(name)
+
+        try:
+            with handler.changed:
+                while True:
+                    for match in handler.matches:
+                        if match["name"] in keys:
+                            handler.matches.remove(match)
+                            return match
+
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or handler.finished:
+                        raise TimeoutError(f"no match for {sorted(keys)}")
+                    handler.changed.wait(remaining)
+        finally:
+            for name in watched:
+                handler.watched.discard(name)
+                if not handler.finished:  # (else, the driver forgot it)
+                    handler.send(what="unwatch", data=name)
+
+    def wait_until_stable(self, quiet=0.05, timeout=None):
+        """wait until the screen went unchanged for quiet seconds
+
+        quiet periods start after the last input, output or screen update
+        seen by the driver (including inputs sent before this call);
+        returns the driver frame number the screen settled on
+        """
+
+        handler = self.handler
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        token = f"{id(self)}-{time.time()}-{threading.get_ident()}"
+        with handler.changed:
+            handler.stable_frames[token] = None
+        handler.send(what="wait_stable", data=dict(token=token, quiet=quiet))
+
+        try:
+            with handler.changed:
+                while handler.stable_frames[token] is None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or handler.finished:
+                        raise TimeoutError(f"screen not stable for {quiet}s")
+                    handler.changed.wait(remaining)
+                return handler.stable_frames[token]
+        finally:
+            with handler.changed:
+                del handler.stable_frames[token]
+
     def show(self, *, colors=False, cursor=False, cropped=True, **kwargs):
         kwargs["display_only"] = kwargs.get("display_only", True)
         kwargs["show_colors"] = kwargs.get("show_colors", colors)
@@ -363,8 +806,8 @@ class pilot_frontend:
         top_line=True,
         bottom_line=True,
     ):
-        last_size = None
         stdin_mode = None
+        renderer = render.frame_renderer()
 
         quiet = not verbose
         hook_stdin = not display_only
@@ -386,14 +829,45 @@ class pilot_frontend:
             self.handler.send("get_value", data="terminal_size")
             self.handler.send("command", data="refresh_lines")
             self.handler.send("command", data="enable_stream_lines")
-            time.sleep(1)
+            try:
+                self.wait_until_stable(timeout=1)
+            except TimeoutError:
+                pass
         if len(self.handler.display) == 0:
             raise TimeoutError("remote send nothing to display :(")
 
         if show_colors:
+            self.handler.send("command", data="enable_rawline_runs")
             self.handler.send("command", data="refresh_rawlines")
             self.handler.send("command", data="enable_stream_rawlines")
 
+        # (the loop wakes up on keystrokes, line updates & local resizes)
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+
+        def _on_resize(signum, frame):
+            try:
+                os.write(wakeup_w, b"\x00")
+            except OSError:
+                pass
+
+        previous_sigwinch = None
+        try:
+            previous_sigwinch = signal.signal(signal.SIGWINCH, _on_resize)
+        except ValueError:  # (not in main thread, size is still checked each frame)
+            pass
+
+        selector = selectors.DefaultSelector()
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        if hook_stdin:
+            selector.register(pty.STDIN_FILENO, selectors.EVENT_READ)
+
+        # (a blinking cursor needs frames at framerate, otherwise only updates)
+        blinking = show_cursor and not show_colors
+        timeout = 1 / framerate if blinking else 1
+
+        handler = None
         try:
             _echo(ansiseq.decoded.smcup, end="")
 
@@ -404,60 +878,34 @@ class pilot_frontend:
                 except tty.error:
                     stdin_mode = None
 
-            while not self.handler.finished:
-
-                if hook_stdin:
-                    r, _, _ = select.select([pty.STDIN_FILENO], [], [], 0)
-                    if pty.STDIN_FILENO in r:
-                        inbuf = os.read(pty.STDIN_FILENO, 1024)
-                        if self.key.CTRL_X.encode() in inbuf:
-                            return
-
-                        if self.key.CTRL_C.encode() in inbuf and exit_hint:
-                            exit_hint = False
-                            _echo(ansiseq.decoded.clear, end="")
-                            _echo(ansiseq.decoded.cup00, end="", flush=True)
-                            _echo("                                                ")
-                            _echo("Press ^X to exit pilot.show(hook_stdin=True)    ")
-                            _echo("                                                ")
-                            time.sleep(1)
-                            _echo(ansiseq.decoded.cup00, end="", flush=True)
-                            _echo("                                                ")
-                            _echo("                                                ")
-                            _echo("                                                ")
-                            _echo(ansiseq.decoded.clear, end="")
-
-                        self.input(data=inbuf, interactive=False, raw=True)
-
-                new_size = shutil.get_terminal_size()
-                if new_size != last_size:
-                    _echo(ansiseq.decoded.clear, end="")
-                    last_size = new_size
+            while True:
+                if handler is not self.handler:  # (first frame, or reconnected)
+                    if handler is not None:
+                        handler.wakeup_fds.discard(wakeup_w)
+                    handler = self.handler
+                    handler.wakeup_fds.add(wakeup_w)
+                if handler.finished:
+                    break
+
+                last_size = shutil.get_terminal_size()
                 nbcols, nbrows = last_size
 
-                colno, lineno = self.cursor
+                colno, lineno = self.cursor or (0, 0)
                 maxlen = 9999 if not cropped else nbcols
 
-                disp = list(self.handler.display)
-                colored = 0
-
-                for _ in range(10):
+                # (rows not yet matched by their colored version are plain)
+                disp = list(handler.display)
+                for i, d in enumerate(disp):
                     if not show_colors:
                         break
 
-                    for i, d in enumerate(disp):
-                        raw = self.handler.raw_display.get(i)
-                        if raw is not None and disp[i] == raw.literal:
-                            colored += 1
-                            if show_cursor and i == lineno - 1:
-                                disp[i] = raw.render(maxlen=maxlen, cursor_at=colno)
-                            else:
-                                disp[i] = raw.render(maxlen=maxlen)
-                            disp[i] += ansiseq.decoded.sgr0
-
-                    if colored > max(nbrows - 6, 0):
-                        break
-                    time.sleep(0.05)
+                    raw = handler.raw_display.get(i)
+                    if raw is not None and disp[i] == raw.literal:
+                        if show_cursor and i == lineno - 1:
+                            disp[i] = raw.render(maxlen=maxlen, cursor_at=colno)
+                        else:
+                            disp[i] = raw.render(maxlen=maxlen)
+                        disp[i] += ansiseq.decoded.sgr0
 
                 curcnt = int(time.time() * framerate) % 4
                 if show_cursor and curcnt > 1 and not show_colors:
@@ -490,23 +938,55 @@ class pilot_frontend:
                 if len(disp) < 1:
                     return
 
-                time.sleep(1 / framerate)
-                _echo(ansiseq.decoded.cup00, end="", flush=True)
+                frame = []
                 if argv:
-                    _echo(f"argv: {self.argv}    ")
+                    frame.append(f"argv: {self.argv}    ")
                 if size:
-                    _echo(f"size: {self.size}     ")
+                    frame.append(f"size: {self.size}     ")
                 if cursor:
-                    _echo(f"cursor: {self.cursor}     ")
+                    frame.append(f"cursor: {self.cursor}     ")
                 if top_line:
-                    _echo(disp[0])
-                    _echo("-----")
+                    frame += [disp[0], "-----"]
 
-                _echo("\n\r".join(disp))
+                frame += disp
 
                 if bottom_line:
-                    _echo("-----")
-                    _echo(disp[-1])
+                    frame += ["-----", disp[-1]]
+
+                renderer.draw(frame, last_size)
+
+                for key, _ in selector.select(timeout):
+                    if key.fd == wakeup_r:
+                        try:
+                            os.read(wakeup_r, common.global_buffer_size)
+                        except BlockingIOError:
+                            pass
+                        continue
+
+                    inbuf = os.read(pty.STDIN_FILENO, 1024)
+                    if not inbuf:
+                        selector.unregister(pty.STDIN_FILENO)
+                        continue
+
+                    if self.key.CTRL_X.encode() in inbuf:
+                        return
+
+                    if self.key.CTRL_C.encode() in inbuf and exit_hint:
+                        exit_hint = False
+                        _echo(ansiseq.decoded.clear, end="")
+                        _echo(ansiseq.decoded.cup00, end="", flush=True)
+                        _echo("                                                ")
+                        _echo("Press ^X to exit pilot.show(hook_stdin=True)    ")
+                        _echo("                                                ")
+                        time.sleep(1)
+                        _echo(ansiseq.decoded.cup00, end="", flush=True)
+                        _echo("                                                ")
+                        _echo("                                                ")
+                        _echo("                                                ")
+                        _echo(ansiseq.decoded.clear, end="")
+                        renderer.reset()
+
+                    self.input(data=inbuf, interactive=False, raw=True)
 
         finally:
             _echo(ansiseq.decoded.rmcup, end="", flush=True)
@@ -514,6 +994,14 @@ class pilot_frontend:
             if stdin_mode is not None:
                 tty.tcsetattr(pty.STDIN_FILENO, tty.TCSAFLUSH, stdin_mode)
 
+            if previous_sigwinch is not None:
+                signal.signal(signal.SIGWINCH, previous_sigwinch)
+            if handler is not None:
+                handler.wakeup_fds.discard(wakeup_w)
+            selector.close()
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+
     def intercept(self, callback=None, decode=False, verbose_hex=False):
         original_method = self.handler.stdin
         is_finished = False
@@ -664,10 +1152,65 @@ class pilot_frontend:
             self.draw2d(y_rows, x_cols, char_matrix=cleanup, **draw_kwargs)
 
 
+def load_userscript(path, name="userscript"):
+    """import the userscript at path, as a module (see main)"""
+
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(name, path)
+
+    userscript = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = userscript
+    spec.loader.exec_module(userscript)
+    return userscript
+
+
 def main():
+    import argparse
+    import shlex
+
+    parser = argparse.ArgumentParser(description="the pty remote controller")
+    parser.add_argument(
+        "userscript",
+        nargs="?",
+        help="run main(pilot) of userscript (default: interactive session)",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="DIR",
+        help="run main(pilot) of every DIR/*.py concurrently (see ptyrc.batch)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="userscripts run at once"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="seconds allowed per userscript"
+    )
+    parser.add_argument(
+        "--spawn",
+        metavar="CMD",
+        help="command wrapped by a headless driver for each userscript",
+    )
+    parser.add_argument(
+        "--report", metavar="FILE", help="write the JSON report here (not stdout)"
+    )
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        import ptyrc.batch as batch  # (multiprocessing, only needed here)
+
+        report = batch.run_batch(
+            batch.find_userscripts(args.batch),
+            jobs=args.jobs,
+            timeout=args.timeout,
+            spawn=shlex.split(args.spawn) if args.spawn else None,
+        )
+        batch.write_report(report, args.report)
+        sys.exit(0 if report["summary"]["failed"] == 0 else 1)
+
     backend = pilot_backend()
 
-    if len(sys.argv) < 2:
+    if args.userscript is None:
 
         def interactive_shell(pilot):
             pilot.wait_for_driver()
@@ -676,18 +1219,6 @@ def main():
         backend.start(callback=interactive_shell)
         sys.exit(0)
 
-    if len(sys.argv) == 2:
-        import importlib.util
-
-        spec = importlib.util.spec_from_file_location("userscript", sys.argv[1])
-
-        userscript = importlib.util.module_from_spec(spec)
-        sys.modules[spec.name] = userscript
-        spec.loader.exec_module(userscript)
-
-        backend.start(callback=lambda pilot: userscript.main(pilot))
-        sys.exit(0)
-
-    if len(sys.argv) > 2:
-        print(f"Usage: {sys.argv[0]} [userscript.py]", file=sys.stderr)
-        sys.exit(1)
+    userscript = load_userscript(args.userscript)
+    backend.start(callback=lambda pilot: userscript.main(pilot))
+    sys.exit(0)
@@ -0,0 +1,105 @@
+import itertools
+import re
+import sys
+
+from wcwidth import wcwidth
+
+from ptyrc.termcap import ansiseq
+
+# (SGR & other CSI sequences take no cell on screen)
+_csi_seq = re.compile("\x1b\\[[0-?]*[ -/]*[@-~]")
+
+
+def clip(row, nbcols):
+    """row cut to at most nbcols cells -> (clipped row, cells it takes)"""
+
+    if row.isascii() and "\x1b" not in row:
+        row = row[:nbcols]
+        return row, len(row)
+
+    parts = []
+    cells = 0
+    pos = 0
+    for match in itertools.chain(_csi_seq.finditer(row), [None]):
+        end = len(row) if match is None else match.start()
+        for char in row[pos:end]:
+            width = max(wcwidth(char), 0)
+            if cells + width > nbcols:
+                return "".join(parts), cells
+            parts.append(char)
+            cells += width
+        if match is not None:
+            parts.append(match.group())
+            pos = match.end()
+    return "".join(parts), cells
+
+
+class frame_renderer:
+    """draws frames (lists of rows) on the local terminal, only emitting
+    cursor moves & the rows (or, for plain rows, the cells) that changed
+    since the last frame drawn"""
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.size = None
+        self.last = []  # (rows as last drawn)
+
+    def reset(self):
+        """forget the last frame (the next one is drawn from scratch)"""
+
+        self.size = None
+        self.last = []
+
+    def draw(self, rows, size):
+        """draw rows (str, may hold SGR sequences) for the local size
+
+        rows are clipped to size, as wrapping or scrolling would shift
+        the rows drawn after them
+        """
+
+        if not ansiseq.ready:
+            ansiseq.initialize()
+        decoded = ansiseq.decoded
+
+        seq = []
+        if size != self.size:
+            seq.append(decoded.sgr0 + decoded.clear)
+            self.size = size
+            self.last = []
+
+        nbcols, nbrows = size
+        rows = list(rows)[:nbrows]
+        for lineno, row in enumerate(rows):
+            last = self.last[lineno] if lineno < len(self.last) else None
+            if row == last:
+                continue
+
+            text, cells = clip(row, nbcols)
+
+            # (plain rows: from the first changed cell only)
+            start = 0
+            if last is not None and text.isascii() and "\x1b" not in text:
+                old, _ = clip(last, nbcols)
+                if old.isascii() and "\x1b" not in old:
+                    while (
+                        start < min(len(text), len(old)) and text[start] == old[start]
+                    ):
+                        start += 1
+
+            # (no el on full rows: the cursor waits to wrap on the last cell)
+            seq.append(decoded.cup(lineno + 1, start + 1))
+            seq.append(text[start:] + decoded.sgr0)
+            if cells < nbcols:
+                seq.append(decoded.el)
+
+        for lineno in range(len(rows), min(len(self.last), nbrows)):
+            seq.append(decoded.cup(lineno + 1, 1) + decoded.el)
+
+        self.last = rows
+        if not seq:
+            return 0
+
+        seq = "".join(seq)
+        self.out.write(seq)
+        self.out.flush()
+        return len(seq)
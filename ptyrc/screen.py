@@ -1,41 +1,311 @@
+import collections
+import threading
+import time
+
 import pyte
+from wcwidth import wcwidth
 
+import ptyrc.cellgrid
 from ptyrc.termcap import charspec
 
+# immutable screen state published by screen.flush
+#
+#   - frame: frame number, monotonically increasing
+#   - size: (nbcols, nbrows)
+#   - display: tuple of rows (as str)
+#   - cells: tuple of rows (as tuple of pyte chars)
+#   - cursor: (x, y) pyte cursor position (starting at zero)
+#   - dirty: sorted list of rows changed since previous frame
+#   - spans: dict of changed (start, end) columns for each dirty row
+#   - trace: None, or timestamps of this frame (see screen.feed origin)
+#
+# (unchanged rows are shared by reference between frames)
+snapshot = collections.namedtuple(
+    "snapshot",
+    ["frame", "size", "display", "cells", "cursor", "dirty", "spans", "trace"],
+)
+
+
+class span_set(set):
+    """set of dirty rows that also tracks the dirty columns of each row
+
+    pyte only calls add & update: rows added that way are fully dirty, except
+    while narrowed (rows are then collected into narrow, for the caller to
+    mark them with the right columns).
+    """
+
+    def __init__(self, main_screen):
+        super().__init__()
+        self.main_screen = main_screen
+        self.spans = dict()  # row -> (start, end) or None (whole row)
+        self.narrow = None
+
+    def add(self, row):
+        if self.narrow is not None:
+            self.narrow.add(row)
+            return
+        super().add(row)
+        self.spans[row] = None
+
+    def update(self, *rowlists):
+        for rows in rowlists:
+            for row in rows:
+                super().add(row)
+                self.spans[row] = None
+
+    def mark(self, row, start, end):
+        super().add(row)
+        if row in self.spans:
+            span = self.spans[row]
+            if span is None:
+                return
+            start, end = min(start, span[0]), max(end, span[1])
+        self.spans[row] = (start, end)
+
+    def clear(self):
+        super().clear()
+        self.spans.clear()
+
+    def get_spans(self):
+        nbcols = self.main_screen.columns
+
+        spans = dict()
+        for row in self:
+            span = self.spans.get(row)
+            if span is None:
+                spans[row] = (0, nbcols)
+            else:
+                spans[row] = (max(span[0], 0), min(span[1], nbcols))
+        return spans
+
+
+class tracked_screen(pyte.Screen):
+    """pyte screen recording which columns of each row changed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        dirty, self.dirty = self.dirty, span_set(self)
+        self.dirty.update(dirty)
+
+    def narrowed(self, method, *args, **kwargs):
+        """call method, returns rows it marked dirty (without marking them)"""
+
+        previous, touched = self.dirty.narrow, set()
+        self.dirty.narrow = touched
+        try:
+            method(*args, **kwargs)
+        finally:
+            self.dirty.narrow = previous
+        return touched
+
+    def draw(self, data):
+        y0, x0 = self.cursor.y, self.cursor.x
+        touched = self.narrowed(super().draw, data)
+        y1, x1 = self.cursor.y, self.cursor.x
+
+        # (combining characters are merged with the cell before the cursor,
+        # and without autowrap, pyte draws over the last cells of the line)
+        start = max(min(x0 - 1, self.columns - 2), 0)
+        for row in touched:
+            if row == y0 and row == y1:
+                self.dirty.mark(row, start, x1 + 1)
+            elif row == y0:
+                self.dirty.mark(row, start, self.columns)
+            elif row == y1:
+                self.dirty.mark(row, 0, x1 + 1)
+            else:
+                self.dirty.update([row])
+
+    def insert_characters(self, *args, **kwargs):
+        x = self.cursor.x
+        for row in self.narrowed(super().insert_characters, *args, **kwargs):
+            self.dirty.mark(row, x, self.columns)
+
+    def delete_characters(self, *args, **kwargs):
+        x = self.cursor.x
+        for row in self.narrowed(super().delete_characters, *args, **kwargs):
+            self.dirty.mark(row, x, self.columns)
+
+    def erase_characters(self, count=None, *args, **kwargs):
+        x = self.cursor.x
+        touched = self.narrowed(super().erase_characters, count, *args, **kwargs)
+        for row in touched:
+            self.dirty.mark(row, x, x + (count or 1))
+
+    def erase_in_line(self, how=0, *args, **kwargs):
+        x = self.cursor.x
+        for row in self.narrowed(super().erase_in_line, how, *args, **kwargs):
+            if how == 0:
+                self.dirty.mark(row, x, self.columns)
+            elif how == 1:
+                self.dirty.mark(row, 0, x + 1)
+            else:
+                self.dirty.update([row])
+
+
+def render_cells(cells):
+    """cells of a row -> text of that row (as pyte renders it)"""
+
+    text = []
+    is_wide_char = False
+    for cell in cells:
+        if is_wide_char:  # (skip stub)
+            is_wide_char = False
+            continue
+        text.append(cell.data)
+        is_wide_char = bool(cell.data) and wcwidth(cell.data[0]) == 2
+    return "".join(text)
+
 
 class screen:
 
-    def __init__(self, terminal_size):
-        self.main_screen = pyte.Screen(*terminal_size)
+    def __init__(
+        self,
+        terminal_size,
+        *,
+        max_pending=1024 * 1024 * 16,
+        overflow="block",
+        overflow_timeout=1,
+    ):
+        assert overflow in ("block", "drop")
+
+        self.main_screen = tracked_screen(*terminal_size)
         self.main_stream = pyte.ByteStream(self.main_screen)
 
-        self.buffer = b""
+        # output chunks waiting for flush, fed to pyte in order
+        self.pending = collections.deque()
+        self.pending_size = 0
+        self.pending_cond = threading.Condition()
+        self.pending_origin = None  # (when the oldest traced chunk was read)
+
+        # past max_pending, feed either waits for a flush (and so slows down the
+        # pty pump) up to overflow_timeout, or right away drops the oldest
+        # chunks (counted in dropped_bytes) to stay under max_pending
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.overflow_timeout = overflow_timeout
+        self.dropped_bytes = 0
+
+        # (seconds spent in pyte)
+        self.emulation_time = 0
+
         self.size = terminal_size  # (nbcols, nbrows)
 
-    def feed(self, input_data):
-        self.buffer += input_data
+        # writers (flush & resize) serialize on lock, readers use snapshot()
+        self.lock = threading.Lock()
+
+        # packed cells (if numpy is installed), only synced with the rows
+        # asked for, when asked for (see get_packed_lines)
+        self.cellgrid = None
+        self.cellgrid_lock = threading.Lock()
+        self.current = self.take_snapshot(None, list(range(self.nbrows)))
+
+    def feed(self, input_data, origin=None):
+        if not input_data:
+            return
+
+        with self.pending_cond:
+            if self.overflow == "block":
+                self.pending_cond.wait_for(
+                    lambda: self.pending_size < self.max_pending,
+                    timeout=self.overflow_timeout,
+                )
+
+            self.pending.append(bytes(input_data))
+            self.pending_size += len(input_data)
+            if origin is not None and self.pending_origin is None:
+                self.pending_origin = origin
+
+            while self.pending_size > self.max_pending and len(self.pending) > 1:
+                dropped = self.pending.popleft()
+                self.pending_size -= len(dropped)
+                self.dropped_bytes += len(dropped)
+
+    def take_snapshot(self, previous, dirty, spans=None, trace=None):
+        """build next snapshot from pyte state (call with lock held)"""
+
+        nbcols, nbrows = self.nbcols, self.nbrows
+        buffer = self.main_screen.buffer
+
+        if previous is None or previous.size != (nbcols, nbrows):
+            display = [None] * nbrows
+            cells = [None] * nbrows
+            dirty = list(range(nbrows))
+            spans = dict()
+        else:
+            display = list(previous.display)
+            cells = list(previous.cells)
+            dirty = [lno for lno in dirty if lno < nbrows]
+            spans = spans or dict()
+
+        for lineno in dirty:
+            line = buffer[lineno]
+            start, end = spans.setdefault(lineno, (0, nbcols))
+
+            # (only re-read changed cells, share the others)
+            if start > 0 or end < nbcols:
+                row = cells[lineno]
+                changed = tuple(line[x] for x in range(start, end))
+                cells[lineno] = row[:start] + changed + row[end:]
+            else:
+                cells[lineno] = tuple(line[x] for x in range(nbcols))
+            display[lineno] = render_cells(cells[lineno])
+
+        cursor = self.main_screen.cursor
+        return snapshot(
+            frame=0 if previous is None else previous.frame + 1,
+            size=(nbcols, nbrows),
+            display=tuple(display),
+            cells=tuple(cells),
+            cursor=(cursor.x, cursor.y),
+            dirty=dirty,
+            spans=spans,
+            trace=trace,
+        )
+
+    def snapshot(self):
+        """last published snapshot (consistent, immutable, lock-free)"""
+        return self.current
 
     def flush(self, callback=None, *, clear=False):
         if not self.is_dirty:
             return False
 
-        buffer, self.buffer = self.buffer, b""
-        self.main_stream.feed(buffer)
+        with self.pending_cond:
+            chunks, self.pending = self.pending, collections.deque()
+            origin, self.pending_origin = self.pending_origin, None
+            self.pending_size = 0
+            self.pending_cond.notify_all()
+
+        with self.lock:
+            trace = None
+            if origin is not None:
+                trace = dict(read=origin, dequeue=time.time())
+
+            started = time.perf_counter()
+            for chunk in chunks:
+                self.main_stream.feed(chunk)
+            self.emulation_time += time.perf_counter() - started
 
-        if not callback:
-            return self.is_dirty
+            if trace is not None:
+                trace["emulate"] = time.time()
 
-        dirty = self.get_dirty_lines()
-        display = self.main_screen.display
+            dirty = self.get_dirty_lines()
+            spans = self.get_dirty_spans()
+            self.main_screen.dirty.clear()
+            if not dirty:
+                return self.is_dirty
 
-        # is this unnecessary?
-        dirty = [lno for lno in dirty if lno < len(display)]
+            current = self.take_snapshot(self.current, dirty, spans, trace)
+            self.current = current
 
-        if clear:
-            self.clear_dirty_lines()
+            if not clear:
+                for lineno, (start, end) in spans.items():
+                    self.main_screen.dirty.mark(lineno, start, end)
 
         if callback:
-            callback(self, dirty, display)
+            callback(self, current.dirty, current.display)
         return self.is_dirty
 
     def resize(self, nbcols=None, nbrows=None, **kwargs):
@@ -46,12 +316,13 @@ class screen:
             nbcols = kwargs.get("columns", nbcols)
         assert nbrows or nbcols
 
-        self.main_screen.resize(lines=nbrows, columns=nbcols)
+        with self.lock:
+            self.main_screen.resize(lines=nbrows, columns=nbcols)
         return (self.nbcols, self.nbrows)
 
     @property
     def display(self):
-        return self.main_screen.display
+        return self.current.display
 
     @property
     def nbcols(self):
@@ -63,13 +334,17 @@ class screen:
 
     @property
     def is_dirty(self):
-        return self.buffer or len(self.main_screen.dirty) > 0
+        return len(self.pending) > 0 or len(self.main_screen.dirty) > 0
 
     def get_dirty_lines(self):
         dirty = list(self.main_screen.dirty)
         dirty.sort()
         return dirty
 
+    def get_dirty_spans(self):
+        """dirty rows -> (start, end) range of their dirty columns"""
+        return self.main_screen.dirty.get_spans()
+
     def clear_dirty_lines(self):
         self.main_screen.dirty.clear()
         return not self.is_dirty
@@ -77,20 +352,31 @@ class screen:
     def get_raw_buffer(self):
         return self.main_screen.buffer
 
-    def get_raw_lines(self, linelist):
-        buffer = self.get_raw_buffer()
-        nbcols = self.nbcols
+    def get_raw_lines(self, linelist, snapshot=None):
+        snapshot = snapshot or self.current
+        cells = snapshot.cells
 
-        linelist.sort()
-        linelist = [lno for lno in linelist if lno < len(buffer)]
+        linelist = sorted(lno for lno in linelist if lno < len(cells))
 
         raw_lines = dict()
         for lineno in linelist:
-            line_buffer = [buffer[lineno][x] for x in range(nbcols)]
-
-            current_line = []
-            for pyte_char in line_buffer:
-                current_line.append(charspec.from_pyte_char(pyte_char))
-            raw_lines[lineno] = current_line
+            raw_lines[lineno] = [charspec.from_pyte_char(c) for c in cells[lineno]]
 
         return raw_lines
+
+    def get_packed_lines(self, linelist, snapshot=None):
+        """rows -> dict of packed rows (see charspec.pack), as of snapshot
+        (defaults to the last one), without blocking flush"""
+
+        snapshot = snapshot or self.current
+        cells = snapshot.cells
+        linelist = sorted(lno for lno in linelist if lno < len(cells))
+
+        if not ptyrc.cellgrid.available():
+            return {lno: ptyrc.cellgrid.pack_row(cells[lno]) for lno in linelist}
+
+        with self.cellgrid_lock:
+            if self.cellgrid is None or self.cellgrid.size != snapshot.size:
+                self.cellgrid = ptyrc.cellgrid.cellgrid(snapshot.size)
+            self.cellgrid.sync(snapshot, linelist)
+            return self.cellgrid.pack_rows(linelist)
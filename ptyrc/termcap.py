@@ -1,4 +1,163 @@
-import subprocess
+import collections
+import json
+import os
+import re
+import struct
+
+# terminfo queries used by ansiseq (capability name, then parameters if any)
+_queries = [
+    ("smcup",),
+    ("rmcup",),
+    ("sc",),  # save cursor
+    ("rc",),  # restore cursor
+    ("clear",),
+    ("el",),  # erase line from cur to end of line
+    ("el1",),  # erase line from start to cur
+    ("ed",),  # erase line from cur to end of screen
+    ("bold",),  # bold
+    ("dim",),  # dim
+    ("sitm",),  # italics
+    ("smul",),  # underline or "underscore" (sic)
+    ("blink",),  # blink
+    ("rev",),  # reverse
+    ("smso",),  # standout (reverse+bold)
+    ("invis",),  # invisible
+    ("sgr0",),  # reset all attributes
+    ("u7",),
+    ("u6", 11110, 22221),
+    ("cup", 0, 0),
+    ("cup", 123456788, 987654320),
+    ("home",),  # eq cup00
+    ("setaf", 0),
+    ("setab", 0),
+]
+
+# (used when neither terminfo, tput nor a cache is available)
+_xterm_fallback = {
+    "smcup": b"\x1b[?1049h\x1b[22;0;0t",
+    "rmcup": b"\x1b[?1049l\x1b[23;0;0t",
+    "sc": b"\x1b7",
+    "rc": b"\x1b8",
+    "clear": b"\x1b[H\x1b[2J",
+    "el": b"\x1b[K",
+    "el1": b"\x1b[1K",
+    "ed": b"\x1b[J",
+    "reset": b"\x1bc",
+    "bold": b"\x1b[1m",
+    "dim": b"\x1b[2m",
+    "sitm": b"\x1b[3m",
+    "smul": b"\x1b[4m",
+    "blink": b"\x1b[5m",
+    "rev": b"\x1b[7m",
+    "smso": b"\x1b[7m",
+    "invis": b"\x1b[8m",
+    "sgr0": b"\x1b(B\x1b[m",
+    "u7": b"\x1b[6n",
+    "u6 11110 22221": b"\x1b[22222;11111R",
+    "cup 0 0": b"\x1b[1;1H",
+    "cup 123456788 987654320": b"\x1b[123456789;987654321H",
+    "home": b"\x1b[H",
+    "setaf 0": b"\x1b[30m",
+    "setab 0": b"\x1b[40m",
+}
+
+
+def _key(query):
+    return " ".join(str(q) for q in query)
+
+
+def _caps_from_curses(term):
+    import curses  # (note: only the first setupterm of a process is effective)
+
+    fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        curses.setupterm(term, fd)
+    finally:
+        os.close(fd)
+
+    caps = dict()
+    for name, *params in _queries:
+        seq = curses.tigetstr(name)
+        if seq is not None and params:
+            seq = curses.tparm(seq, *params)
+        caps[_key((name, *params))] = seq or b""
+
+    # (as tput does, clear also erases the scrollback if possible)
+    caps["clear"] += curses.tigetstr("E3") or b""
+
+    # (what tput reset sends)
+    caps["reset"] = b"".join(
+        curses.tigetstr(rs) or curses.tigetstr(init) or b""
+        for rs, init in [("rs1", "is1"), ("rs2", "is2"), ("rs3", "is3")]
+    )
+    return caps
+
+
+def _caps_from_tput(term):
+    import subprocess
+
+    caps = dict()
+    for query in _queries + [("reset",)]:
+        argv = ["tput", "-T", term] + [str(q) for q in query]
+        try:
+            caps[_key(query)] = subprocess.check_output(argv, stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            caps[_key(query)] = b""
+
+    if not any(caps.values()):
+        raise OSError(f"tput knows nothing about {term}")
+    return caps
+
+
+def _terminfo_cache_path(term):
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_dir, "ptyrc", f"terminfo-{term.replace('/', '_')}.json")
+
+
+def _load_cache(term):
+    try:
+        with open(_terminfo_cache_path(term)) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {k: v.encode("latin-1") for k, v in cached.items()}
+
+
+def _store_cache(term, caps):
+    path = _terminfo_cache_path(term)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump({k: v.decode("latin-1") for k, v in caps.items()}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def load_capabilities(term=None):
+    """terminfo sequences for term (terminfo, else on-disk cache, else tput)"""
+
+    term = term or os.environ.get("TERM") or "xterm"
+
+    try:
+        caps = _caps_from_curses(term)
+    except Exception:  # (no curses module, no terminfo entry for term...)
+        caps = None
+
+    if caps is None:
+        caps = _load_cache(term)
+        if caps is not None:
+            return caps
+
+        try:
+            caps = _caps_from_tput(term)
+        except OSError:  # (no tput, or unknown term)
+            return dict(_xterm_fallback)
+
+    if _load_cache(term) != caps:
+        _store_cache(term, caps)
+    return caps
 
 
 class ansiseq:
@@ -17,40 +176,19 @@ class ansiseq:
         pass
 
     @classmethod
-    def initialize(cls):
+    def initialize(cls, term=None):
         if cls.ready:
             return
 
-        cls.smcup = subprocess.check_output(["tput", "smcup"])
-        cls.rmcup = subprocess.check_output(["tput", "rmcup"])
-        cls.sc = subprocess.check_output(["tput", "sc"])  # save cursor
-        cls.rc = subprocess.check_output(["tput", "rc"])  # restore cursor
-        cls.clear = subprocess.check_output(["tput", "clear"])
-        cls.el = subprocess.check_output(
-            ["tput", "el"]
-        )  # erase line from cur to end of line
-        cls.el1 = subprocess.check_output(
-            ["tput", "el1"]
-        )  # erase line from start to cur
-        cls.ed = subprocess.check_output(
-            ["tput", "ed"]
-        )  # erase line from cur to end of screen
-        cls.reset = subprocess.check_output(["tput", "reset"])
-        cls.bold = subprocess.check_output(["tput", "bold"])  # bold
-        cls.dim = subprocess.check_output(["tput", "dim"])  # dim
-        cls.sitm = subprocess.check_output(["tput", "sitm"])  # italics
-        cls.smul = subprocess.check_output(
-            ["tput", "smul"]
-        )  # underline or "underscore" (sic)
-        cls.blink = subprocess.check_output(["tput", "blink"])  # blink
-        cls.rev = subprocess.check_output(["tput", "rev"])  # reverse
-        cls.smso = subprocess.check_output(["tput", "smso"])  # standout (reverse+bold)
-        cls.invis = subprocess.check_output(["tput", "invis"])  # invisible
+        caps = load_capabilities(term)
+        for name, *params in _queries:
+            if not params:
+                setattr(cls, name, caps[name])
+        cls.reset = caps["reset"]
         cls.strike = cls.smul.replace(b"4m", b"9m")
-        cls.sgr0 = subprocess.check_output(["tput", "sgr0"])  # reset all attributes
 
-        cls.cursor = subprocess.check_output(["tput", "u7"])
-        cls.curposXX = subprocess.check_output(["tput", "u6", "11110", "22221"])
+        cls.cursor = caps["u7"]
+        cls.curposXX = caps["u6 11110 22221"]
         cls.curpos_suffix = cls.curposXX[-1:]
         cls.curpos_prefix = cls.curposXX[: -len(b"22222;11111" + cls.curpos_suffix)]
         cls.curpos_charset = b"0123456789;R"
@@ -60,17 +198,16 @@ class ansiseq:
             )
         )
 
-        cls.cup00 = subprocess.check_output(["tput", "cup", "0", "0"])
-        cls.cupXX = subprocess.check_output(["tput", "cup", "123456788", "987654320"])
-        cls.home = subprocess.check_output(["tput", "home"])  # eq cup00
+        cls.cup00 = caps["cup 0 0"]
+        cls.cupXX = caps["cup 123456788 987654320"]
         cls.cup = lambda x, y: (
             cls.cupXX.replace(b"123456789", str(x).encode()).replace(
                 b"987654321", str(y).encode()
             )
         )
 
-        cls.setaf0 = subprocess.check_output(["tput", "setaf", "0"])
-        cls.setab0 = subprocess.check_output(["tput", "setab", "0"])
+        cls.setaf0 = caps["setaf 0"]
+        cls.setab0 = caps["setab 0"]
         cls.setaf = lambda c: cls.setaf0.replace(b"30", str(c).encode())
         cls.setab = lambda c: cls.setab0.replace(b"40", str(c).encode())
 
@@ -94,14 +231,117 @@ class ansiseq:
         cls.ready = True
 
 
-_cache_pyte2raw = dict()
-_cache_raw2packed = dict()
-_cache_packed2raw = dict()
+class bounded_cache:
+    """size-bounded LRU mapping, with hit/miss/eviction counters"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:  # (evicted by another thread meanwhile)
+            pass
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            try:
+                self.entries.popitem(last=False)
+            except KeyError:
+                break
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return dict(
+            size=len(self.entries),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+cache_size = 1 << 15  # (entries per cache)
+
+_cache_interned = bounded_cache(cache_size)
+_cache_pyte2raw = bounded_cache(cache_size)
+_cache_raw2packed = bounded_cache(cache_size)
+_cache_packed2raw = bounded_cache(cache_size)
+
+
+_caches = dict(
+    interned=_cache_interned,
+    pyte2raw=_cache_pyte2raw,
+    raw2packed=_cache_raw2packed,
+    packed2raw=_cache_packed2raw,
+)
+
+
+def cache_stats():
+    """name -> hits, misses, evictions & size of each charspec cache"""
+
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def clear_caches():
+    for cache in _caches.values():
+        cache.clear()
+
+
+# attribute word, as the first 7 bytes of charspec.pack() (big endian):
+#   flags (8 bits) | fg (3 bytes: code, 0, 0 or r, g, b) | bg (idem)
+flag_bits = dict(
+    bold=0b00000001,
+    italics=0b00000010,
+    underscore=0b00000100,
+    strikethrough=0b00001000,
+    reverse=0b00010000,
+    blink=0b00100000,
+)
+fg_is256_flag = 0b01000000
+bg_is256_flag = 0b10000000
+_color_names = [
+    "black",
+    "red",
+    "green",
+    "brown",
+    "blue",
+    "magenta",
+    "cyan",
+    "white",
+    None,  # (mode256)
+    "default",
+]
 
 
 class charspec:
+    """immutable, interned cell: data (utf-8) & a packed attribute word"""
+
+    __slots__ = ("data", "attrs", "seq", "_hash")
+
     datamaxsz = 8
     packed_size = 8 + datamaxsz
+    attrs_size = 7
 
     @staticmethod
     def from_pyte_char(pyte_char):
@@ -110,11 +350,11 @@ class charspec:
             return raw
 
         raw = charspec(**pyte_char._asdict())
-        _cache_pyte2raw[pyte_char] = raw
+        _cache_pyte2raw.put(pyte_char, raw)
         return raw
 
-    def __init__(
-        self,
+    def __new__(
+        cls,
         data=" ",
         fg="default",
         bg="default",
@@ -129,174 +369,171 @@ class charspec:
         if isinstance(data, str):
             data = data.encode()
         data = bytes(data)
-        self.datasz = len(data)
-        self.data = data
-
-        # handle foreground color
-        if isinstance(fg, tuple):
-            fg = bytes(fg)
-        if isinstance(fg, bytes):
-            assert len(fg) == 3  # fg color may be (1, 2, 3) or b'\x01\x02\x03'
-            fg = fg.hex().lower()
-
-        self.fg_name = fg
-        self.fg_code, self.fg_is256 = self.color_to_code(fg, foreground=True)
-        self.fg_seq = self.colcode_to_seq(self.fg_code, self.fg_is256, foreground=True)
-
-        # handle background color
-        if isinstance(bg, tuple):
-            bg = bytes(bg)
-        if isinstance(bg, bytes):
-            assert len(bg) == 3  # bg color may be (1, 2, 3) or b'\x01\x02\x03'
-            bg = bg.hex().lower()
-
-        self.bg_name = bg
-        self.bg_code, self.bg_is256 = self.color_to_code(bg, background=True)
-        self.bg_seq = self.colcode_to_seq(self.bg_code, self.bg_is256, background=True)
-
-        self.flags = dict(
-            bold=bold,
-            italics=italics,
-            underscore=underscore,
-            strikethrough=strikethrough,
-            reverse=reverse,
-            blink=blink,
-        )
-        self.flags_seq = self.flags_to_seq(**self.flags)
 
-        self.seq = (
-            (self.fg_seq or b"")
-            + (self.bg_seq or b"")
-            + b"".join(v for v in self.flags_seq.values())
-        )
+        bitflags = 0
+        bitflags |= flag_bits["bold"] if bold else 0
+        bitflags |= flag_bits["italics"] if italics else 0
+        bitflags |= flag_bits["underscore"] if underscore else 0
+        bitflags |= flag_bits["strikethrough"] if strikethrough else 0
+        bitflags |= flag_bits["reverse"] if reverse else 0
+        bitflags |= flag_bits["blink"] if blink else 0
+
+        fg_code, fg_is256 = cls.color_to_code(fg, foreground=True)
+        bg_code, bg_is256 = cls.color_to_code(bg, background=True)
+        bitflags |= fg_is256_flag if fg_is256 else 0
+        bitflags |= bg_is256_flag if bg_is256 else 0
+
+        fgcol = fg_code if fg_is256 else (fg_code, 0, 0)
+        bgcol = bg_code if bg_is256 else (bg_code, 0, 0)
+        attrs = int.from_bytes(bytes([bitflags, *fgcol, *bgcol]), "big")
+
+        return cls.from_attrs(data, attrs)
+
+    @classmethod
+    def from_attrs(cls, data, attrs):
+        """(data bytes, attribute word) -> interned charspec"""
+
+        key = (data, attrs)
+        self = _cache_interned.get(key)
+        if self is not None:
+            return self
+
+        self = object.__new__(cls)
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "attrs", attrs)
+        object.__setattr__(self, "_hash", hash(key))
+
+        raw = attrs.to_bytes(cls.attrs_size, "big")
+        fg_is256 = bool(raw[0] & fg_is256_flag)
+        bg_is256 = bool(raw[0] & bg_is256_flag)
+        fg_code = tuple(raw[1:4]) if fg_is256 else raw[1]
+        bg_code = tuple(raw[4:7]) if bg_is256 else raw[4]
+        seq = cls.colcode_to_seq(fg_code, fg_is256, foreground=True)
+        seq += cls.colcode_to_seq(bg_code, bg_is256, background=True)
+        seq += b"".join(v for v in self.flags_seq.values())
+        object.__setattr__(self, "seq", seq)
+
+        _cache_interned.put(key, self)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("charspec is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("charspec is immutable")
 
     def __hash__(self):
-        return hash((self.data, self.seq))
+        return self._hash
 
-    def pack(self):
-        if self in _cache_raw2packed:
-            return _cache_raw2packed[self]
+    def __eq__(self, other):
+        if not isinstance(other, charspec):
+            return NotImplemented
+        return self.data == other.data and self.attrs == other.attrs
 
-        bitflags = 0
-        bitflags |= 0b00000001 if self.flags["bold"] else 0
-        bitflags |= 0b00000010 if self.flags["italics"] else 0
-        bitflags |= 0b00000100 if self.flags["underscore"] else 0
-        bitflags |= 0b00001000 if self.flags["strikethrough"] else 0
-        bitflags |= 0b00010000 if self.flags["reverse"] else 0
-        bitflags |= 0b00100000 if self.flags["blink"] else 0
-        bitflags |= 0b01000000 if self.fg_is256 else 0
-        bitflags |= 0b10000000 if self.bg_is256 else 0
-
-        fgcol = self.fg_code if self.fg_is256 else (self.fg_code, 0, 0)
-        bgcol = self.bg_code if self.bg_is256 else (self.bg_code, 0, 0)
+    def __reduce__(self):
+        return (charspec.from_attrs, (self.data, self.attrs))
 
-        assert self.datasz <= self.datamaxsz
-        datapack = bytes(
-            self.data[i] if i < self.datasz else 0 for i in range(self.datamaxsz)
-        )
+    @property
+    def datasz(self):
+        return len(self.data)
 
+    @property
+    def bitflags(self):
+        return self.attrs >> 48
+
+    @property
+    def flags(self):
+        bitflags = self.bitflags
+        return {name: bool(bitflags & bit) for name, bit in flag_bits.items()}
+
+    @property
+    def flags_seq(self):
+        return self.flags_to_seq(**self.flags)
+
+    @property
+    def fg_is256(self):
+        return bool(self.bitflags & fg_is256_flag)
+
+    @property
+    def bg_is256(self):
+        return bool(self.bitflags & bg_is256_flag)
+
+    @property
+    def fg_code(self):
+        fgcol = tuple(self.attrs.to_bytes(self.attrs_size, "big")[1:4])
+        return fgcol if self.fg_is256 else fgcol[0]
+
+    @property
+    def bg_code(self):
+        bgcol = tuple(self.attrs.to_bytes(self.attrs_size, "big")[4:7])
+        return bgcol if self.bg_is256 else bgcol[0]
+
+    @property
+    def fg_name(self):
+        return self.code_to_color(self.fg_code, self.fg_is256, foreground=True)
+
+    @property
+    def bg_name(self):
+        return self.code_to_color(self.bg_code, self.bg_is256, background=True)
+
+    @property
+    def fg_seq(self):
+        return self.colcode_to_seq(self.fg_code, self.fg_is256, foreground=True)
+
+    @property
+    def bg_seq(self):
+        return self.colcode_to_seq(self.bg_code, self.bg_is256, background=True)
+
+    def pack(self):
+        retvalue = _cache_raw2packed.get(self)
+        if retvalue is not None:
+            return retvalue
+
+        assert self.datasz <= self.datamaxsz
         retvalue = (
-            bytes([bitflags] + list(fgcol) + list(bgcol) + [self.datasz]) + datapack
+            self.attrs.to_bytes(self.attrs_size, "big")
+            + bytes([self.datasz])
+            + self.data.ljust(self.datamaxsz, b"\x00")
         )
 
-        _cache_raw2packed[self] = retvalue
+        _cache_raw2packed.put(self, retvalue)
         return retvalue
 
     @classmethod
     def unpack(cls, packed_bytes):
         assert len(packed_bytes) == cls.packed_size
 
-        if packed_bytes in _cache_packed2raw:
-            return _cache_packed2raw[packed_bytes]
-
-        bitflags = packed_bytes[0]
-        bold = bool(bitflags & 0b00000001)
-        italics = bool(bitflags & 0b00000010)
-        underscore = bool(bitflags & 0b00000100)
-        strikethrough = bool(bitflags & 0b00001000)
-        reverse = bool(bitflags & 0b00010000)
-        blink = bool(bitflags & 0b00100000)
-        fg_is256 = bool(bitflags & 0b01000000)
-        bg_is256 = bool(bitflags & 0b10000000)
-
-        fg = ""
-        bg = ""
-        if fg_is256:
-            fg = packed_bytes[1:4].hex().lower()
-        if bg_is256:
-            bg = packed_bytes[4:7].hex().lower()
-
-        if not fg_is256:
-            fg_code = packed_bytes[1]
-            if fg_code // 90 > 0:
-                fg = "bright"
-            if fg_code % 10 == 0:
-                fg += "black"
-            if fg_code % 10 == 1:
-                fg += "red"
-            if fg_code % 10 == 2:
-                fg += "green"
-            if fg_code % 10 == 3:
-                fg += "brown"
-            if fg_code % 10 == 4:
-                fg += "blue"
-            if fg_code % 10 == 5:
-                fg += "magenta"
-            if fg_code % 10 == 6:
-                fg += "cyan"
-            if fg_code % 10 == 7:
-                fg += "white"
-            assert fg_code % 10 != 8
-            if fg_code % 10 == 9:
-                fg += "default"
-            assert fg != "brightdefault"
-
-        if not bg_is256:
-            bg_code = packed_bytes[4]
-            if bg_code // 100 > 0:
-                bg = "bright"
-            if bg_code % 10 == 0:
-                bg += "black"
-            if bg_code % 10 == 1:
-                bg += "red"
-            if bg_code % 10 == 2:
-                bg += "green"
-            if bg_code % 10 == 3:
-                bg += "brown"
-            if bg_code % 10 == 4:
-                bg += "blue"
-            if bg_code % 10 == 5:
-                bg += "magenta"
-            if bg_code % 10 == 6:
-                bg += "cyan"
-            if bg_code % 10 == 7:
-                bg += "white"
-            assert bg_code % 10 != 8
-            if bg_code % 10 == 9:
-                bg += "default"
-            assert bg != "brightdefault"
+        packed_bytes = bytes(packed_bytes)
+        retvalue = _cache_packed2raw.get(packed_bytes)
+        if retvalue is not None:
+            return retvalue
 
         datasz = packed_bytes[7]
-        datapacked = packed_bytes[8:]
-
         assert datasz <= cls.datamaxsz
-        data = datapacked[:datasz].decode()
-        retvalue = cls(
-            data=data,
-            fg=fg,
-            bg=bg,
-            bold=bold,
-            italics=italics,
-            underscore=underscore,
-            strikethrough=strikethrough,
-            reverse=reverse,
-            blink=blink,
-        )
 
-        _cache_packed2raw[packed_bytes] = retvalue
+        attrs = int.from_bytes(packed_bytes[: cls.attrs_size], "big")
+        data = packed_bytes[8 : 8 + datasz]
+        data.decode()  # (validates utf-8)
+
+        # (the unused bytes of non-256 colors are not significant)
+        bitflags = attrs >> 48
+        if not bitflags & fg_is256_flag:
+            attrs &= ~(0xFFFF << 24)
+        if not bitflags & bg_is256_flag:
+            attrs &= ~0xFFFF
+
+        retvalue = cls.from_attrs(data, attrs)
+        assert retvalue.fg_name != "brightdefault"
+        assert retvalue.bg_name != "brightdefault"
+
+        _cache_packed2raw.put(packed_bytes, retvalue)
         return retvalue
 
-    def flags_to_seq(self, bold, italics, underscore, strikethrough, reverse, blink):
+    @staticmethod
+    def flags_to_seq(bold, italics, underscore, strikethrough, reverse, blink):
+        if not ansiseq.ready:
+            ansiseq.initialize()
+
         seqs = dict()
         if bold:
             seqs["bold"] = ansiseq.bold
@@ -312,9 +549,17 @@ class charspec:
             seqs["blink"] = ansiseq.blink
         return seqs
 
-    def color_to_code(self, colorname, *, foreground=False, background=False):
+    @staticmethod
+    def color_to_code(colorname, *, foreground=False, background=False):
         assert (foreground or background) and not (foreground and background)
 
+        # fg/bg color may be (1, 2, 3) or b'\x01\x02\x03'
+        if isinstance(colorname, tuple):
+            colorname = bytes(colorname)
+        if isinstance(colorname, bytes):
+            assert len(colorname) == 3
+            colorname = colorname.hex().lower()
+
         base = None
         if foreground:
             base = 30
@@ -352,7 +597,21 @@ class charspec:
             return (asval, True)
         return (asval, False)
 
-    def colcode_to_seq(self, colorcode, is_256, *, foreground=False, background=False):
+    @staticmethod
+    def code_to_color(colorcode, is_256, *, foreground=False, background=False):
+        assert (foreground or background) and not (foreground and background)
+
+        if is_256:
+            return bytes(colorcode).hex().lower()
+
+        assert colorcode % 10 != 8
+        bright = 90 if foreground else 100
+        name = "bright" if colorcode >= bright else ""
+        name += _color_names[colorcode % 10]
+        return name
+
+    @staticmethod
+    def colcode_to_seq(colorcode, is_256, *, foreground=False, background=False):
         assert (foreground or background) and not (foreground and background)
         if not ansiseq.ready:
             ansiseq.initialize()
@@ -407,10 +666,176 @@ class charspec:
         return f"charspec({self.data}{attr})"
 
 
+# rawline encodings (see set_rawline):
+#   1: charspec.pack() of each cell, concatenated
+#   2: runs of cells sharing an attribute word (see pack_runs), as:
+#     u16 palette size, then the palette (attribute words, 7 bytes each)
+#     then runs: u16 palette index, u16 nbcells, u8 mode, text
+#       mode 0: nbcells bytes, one per cell
+#       mode 1: nbcells times (u8 datasz, data)
+#       mode 2: (u8 datasz, data) once, repeated nbcells times
+_run_header = struct.Struct(">HHB")
+_min_repeat = 8  # (cells, below which repeats are not split in their own run)
+
+# (matches a maximal run of packed cells starting with the same attributes)
+_attrs_run = re.compile(
+    rb"(.{%d}).{%d}(?:\1.{%d})*"
+    % (
+        charspec.attrs_size,
+        charspec.packed_size - charspec.attrs_size,
+        charspec.packed_size - charspec.attrs_size,
+    ),
+    re.DOTALL,
+)
+
+
+def _trailing_repeat(cells):
+    """number of identical packed cells at the end of cells"""
+
+    size = charspec.packed_size
+    last = cells[-size:]
+    low, high = 1, len(cells) // size
+    while low < high:
+        middle = (low + high + 1) // 2
+        if cells.endswith(last * middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _run_text(cells):
+    size = charspec.packed_size
+    asz = charspec.attrs_size
+    nbcells = len(cells) // size
+
+    if nbcells >= _min_repeat and cells == cells[:size] * nbcells:
+        return 2, cells[asz : asz + 1 + cells[asz]]
+    if cells[asz::size] == b"\x01" * nbcells:
+        return 0, cells[asz + 1 :: size]
+    return 1, b"".join(
+        cells[start + asz : start + asz + 1 + cells[start + asz]]
+        for start in range(0, len(cells), size)
+    )
+
+
+def pack_runs(packed):
+    """rawline (encoding 1) -> rawline (encoding 2)"""
+
+    size = charspec.packed_size
+    assert len(packed) % size == 0
+
+    palette = dict()
+    runs = []
+    for match in _attrs_run.finditer(packed):
+        index = palette.setdefault(match.group(1), len(palette))
+        cells = match.group(0)
+
+        # (trailing blanks are split in their own run)
+        parts = [cells]
+        nbcells = len(cells) // size
+        repeat = _trailing_repeat(cells)
+        if _min_repeat <= repeat < nbcells:
+            split = (nbcells - repeat) * size
+            parts = [cells[:split], cells[split:]]
+
+        for cells in parts:
+            mode, text = _run_text(cells)
+            runs.append(_run_header.pack(index, len(cells) // size, mode) + text)
+
+    return struct.pack(">H", len(palette)) + b"".join(palette) + b"".join(runs)
+
+
+def unpack_runs(encoded):
+    """rawline (encoding 2) -> rawline (encoding 1), exactly as packed"""
+
+    maxsz = charspec.datamaxsz
+    asz = charspec.attrs_size
+
+    (nbattrs,) = struct.unpack_from(">H", encoded, 0)
+    offset = 2
+    palette = []
+    for _ in range(nbattrs):
+        palette.append(encoded[offset : offset + asz])
+        offset += asz
+
+    packed = []
+    while offset < len(encoded):
+        index, nbcells, mode = _run_header.unpack_from(encoded, offset)
+        offset += _run_header.size
+        attrs = palette[index]
+
+        if mode == 0:
+            for data in encoded[offset : offset + nbcells]:
+                packed.append(attrs + b"\x01" + bytes([data]).ljust(maxsz, b"\x00"))
+            offset += nbcells
+        elif mode == 1:
+            for _ in range(nbcells):
+                datasz = encoded[offset]
+                data = encoded[offset + 1 : offset + 1 + datasz]
+                packed.append(attrs + bytes([datasz]) + data.ljust(maxsz, b"\x00"))
+                offset += 1 + datasz
+        elif mode == 2:
+            datasz = encoded[offset]
+            data = encoded[offset + 1 : offset + 1 + datasz]
+            packed.append(
+                (attrs + bytes([datasz]) + data.ljust(maxsz, b"\x00")) * nbcells
+            )
+            offset += 1 + datasz
+        else:
+            raise ValueError(f"Unknown run mode: {mode}")
+
+    return b"".join(packed)
+
+
 class linespec:
+    """line as spans of cells sharing attributes, with memoized renders"""
+
+    max_renders = 8  # (memoized renders per line)
+
     def __init__(self, charlist):
-        self.charlist = charlist
-        self.literal = (b"".join([c.data for c in charlist])).decode()
+        self._state = ([], "", 0, dict())
+        self.update(charlist)
+
+    def update(self, charlist):
+        """replace the content of the line (keeps renders if unchanged)"""
+
+        spans = []
+        for char in charlist:
+            if spans and spans[-1][0].attrs == char.attrs:
+                spans[-1][1].append(char.data)
+            else:
+                spans.append((char, [char.data]))
+
+        if spans == self.spans:
+            return False
+
+        literal = b"".join(b"".join(datas) for _, datas in spans).decode()
+        nbcells = sum(len(datas) for _, datas in spans)
+
+        # (swapped at once, as interact() renders while set_rawline updates)
+        self._state = (spans, literal, nbcells, dict())
+        return True
+
+    @property
+    def spans(self):
+        """list of (charspec of the first cell, list of data of each cell)"""
+        return self._state[0]
+
+    @property
+    def literal(self):
+        return self._state[1]
+
+    @property
+    def charlist(self):
+        return [
+            charspec.from_attrs(data, char.attrs)
+            for char, datas in self.spans
+            for data in datas
+        ]
+
+    def __len__(self):
+        return self._state[2]
 
     def __getitem__(self, idx):
         return self.charlist[idx]
@@ -424,59 +849,83 @@ class linespec:
         maxlen=None,
         cursor_at=None,
     ):
-        line = "" if decode else b""
+        spans, _, nbcells, renders = self._state
+
+        if maxlen is not None and maxlen >= nbcells:
+            maxlen = None
+        if cursor_at is not None and not 0 < cursor_at <= min(
+            nbcells, nbcells if maxlen is None else maxlen
+        ):
+            cursor_at = None
+
+        key = (decode, start_clean, end_clean, maxlen, cursor_at)
+        line = renders.get(key)
+        if line is not None:
+            return line
+
+        line = self._render(spans, start_clean, end_clean, maxlen, cursor_at)
+        if decode:
+            line = line.decode()
+
+        if len(renders) >= self.max_renders:
+            renders.clear()
+        renders[key] = line
+        return line
 
+    @staticmethod
+    def _render(spans, start_clean, end_clean, maxlen, cursor_at):
         if not ansiseq.ready:
             ansiseq.initialize()
 
-        if decode and start_clean:
-            line += ansiseq.decoded.sgr0
-        elif start_clean:
-            line += ansiseq.sgr0
-
-        last_char = None
-        for i, next_char in enumerate(self.charlist):
-            if maxlen is not None and i >= maxlen:
-                continue
-
-            if cursor_at is not None and i == cursor_at - 1:
-                flags = dict(next_char.flags)
-                flags["reverse"] = not flags.get("reverse", False)
-                next_char = charspec(
-                    data=next_char.data,
-                    fg=next_char.fg_name,
-                    bg=next_char.bg_name,
-                    **flags,
+        # (style, nbcells, text) of each segment of the line
+        segments = []
+        column = 0
+        for char, datas in spans:
+            start = column
+            column += len(datas)
+            if maxlen is not None:
+                datas = datas[: max(maxlen - start, 0)]
+
+            cursor = -1 if cursor_at is None else cursor_at - 1 - start
+            if 0 <= cursor < len(datas):
+                reverse = charspec.from_attrs(
+                    datas[cursor], char.attrs ^ (flag_bits["reverse"] << 48)
                 )
+                segments.append((char, cursor, b"".join(datas[:cursor])))
+                segments.append((reverse, 1, datas[cursor]))
+                datas = datas[cursor + 1 :]
+            segments.append((char, len(datas), b"".join(datas)))
+
+        line = [ansiseq.sgr0] if start_clean else []
+        previous = None
+        for style, nbcells, text in segments:
+            if nbcells == 0:
+                continue
 
-            char_render = next_char.render(previous_char=last_char, decode=decode)
-            line += char_render
-            last_char = next_char
+            if previous is None:
+                line.append(style.seq)
+            elif previous.seq != style.seq:
+                line.append(ansiseq.sgr0 + style.seq)
+            line.append(text)
+            previous = style
 
-        if decode and end_clean:
-            line += ansiseq.decoded.sgr0
-        elif end_clean:
-            line += ansiseq.sgr0
-
-        return line
+        if end_clean:
+            line.append(ansiseq.sgr0)
+        return b"".join(line)
 
     def __repr__(self):
         line = ""
         last_spec = None
-        for cspec in self.charlist:
-            cstr = cspec.__repr__()
-            cstr = cstr[len("charspec(b'") :][: -len(")")]
-            if len(cstr) == 2:
-                if last_spec is not None:
-                    line += "<default>"
-                    last_spec = None
-                line += cstr[0]
-            elif cstr[1] == "'" and cstr[2] == ",":
-                new_spec = cstr[3:]
-                if new_spec != last_spec:
-                    line += f"<{new_spec}>"
-                    last_spec = new_spec
-                line += cstr[0]
-            else:
-                line += f"<{cspec.__repr__()}>"
+        for char, datas in self.spans:
+            spec = repr(char)[len("charspec(") : -len(")")]
+            spec = spec.split(",", 1)[1] if "," in spec else None
+
+            if spec != last_spec:
+                line += "<default>" if spec is None else f"<{spec}>"
+                last_spec = spec
+            for data in datas:
+                if len(data) == 1 and data.isascii() and data != b"'":
+                    line += data.decode()
+                else:
+                    line += f"<{charspec.from_attrs(data, char.attrs)!r}>"
         return f"linespec('{line}')"
@@ -26,6 +26,7 @@ setup(
     long_description=long_description(),
     long_description_content_type="text/markdown",
     install_requires=load_requirements("requirements.txt"),
+    extras_require={"numpy": ["numpy"]},
     entry_points={
             'console_scripts': [
                 'ptyrc-driver = ptyrc.driver:main',